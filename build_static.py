@@ -1,26 +1,75 @@
 """build_static.py
 Genera un sitio estático en `public/` a partir de los markdown en `entries/`
-- Convierte cada `.md` a HTML usando markdown
+- Convierte cada `.md` a HTML saneado con `encyclopedia/render.py` (el mismo
+  pipeline markdown + bleach que usan las vistas)
 - Copia assets estáticos a `public/static/`
-- Crea `index.html` con tarjetas usando metadata de `datas/wikis.json` si existe
+- Crea `index.html` con tarjetas usando metadata de `datas/wikis.json` si existe,
+  paginado: `index.html` es la página 1 y `index/page-N/index.html` las demás
+
+El build es incremental: `public/.build-manifest.json` guarda el hash de cada
+fuente y los archivos que generó, de modo que solo se re-renderizan las
+entradas modificadas, solo se copian los assets que cambiaron, se eliminan las
+páginas de entradas borradas y las páginas index/search/random solo se
+regeneran cuando cambia el conjunto de títulos o la metadata.
+
+Para poder cachear los assets indefinidamente, cada CSS/JS/imagen se publica
+también con el hash de su contenido en el nombre (`stylesv1.<hash>.css`) y las
+páginas enlazan a esa versión. Cada HTML/CSS/JS/JSON generado va acompañado de
+sus variantes precomprimidas `.gz` y `.br` (esta última si `brotli` está
+instalado).
 
 Uso:
-    python build_static.py
+    python build_static.py          # build incremental
+    python build_static.py --full   # borra public/ y reconstruye todo
+    python build_static.py -j 0     # renderiza en paralelo, un proceso por CPU
 """
+import argparse
+import gzip
+import hashlib
 import os
 import shutil
 import json
 import re
+import sys
 import unicodedata
-from markdown import markdown
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
+from encyclopedia import render
+from encyclopedia.images import ImageRegistry
+from encyclopedia.storage import read_metadata
+from encyclopedia.text import extract_links, tokenize
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz siblings are written
+    brotli = None
+
 ROOT = Path(__file__).parent
 ENTRIES = ROOT / "entries"
 DATAS = ROOT / "datas" / "wikis.json"
+DATAS_JOURNAL = ROOT / "datas" / "wikis.log"
 PUBLIC = ROOT / "public"
 TEMPLATES = ROOT / "encyclopedia" / "templates" / "encyclopedia"
 STATIC_SRC = [ROOT / "static", ROOT / "encyclopedia" / "static"]
+IMAGES = ImageRegistry(ROOT / "encyclopedia" / "static" / "images")
+MANIFEST = PUBLIC / ".build-manifest.json"
+# Bump when the generated HTML changes in a way source hashes can't detect
+BUILD_VERSION = 7
+# Outputs that get precompressed .gz/.br siblings
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg"}
+# Assets that are also published under a content-hashed name
+FINGERPRINTED = {".css", ".js", ".svg", ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".avif", ".ico"}
+# Cards per index page
+INDEX_PAGE_SIZE = 48
+# Search postings are sharded by the first characters of each term
+SEARCH_SHARD_PREFIX = 2
+# A term in the title counts as this many occurrences in the body
+SEARCH_TITLE_WEIGHT = 5
+# Asset URL -> fingerprinted URL for the current build, filled by main()
+ASSET_URLS = {}
+# Seconds spent per render stage ("markdown", "bleach") in this build
+RENDER_TIMINGS = {}
 
 BASE_HTML = """<!doctype html>
 <html lang=\"es\"> 
@@ -74,8 +123,8 @@ def slugify(value):
         return value or 'untitled'
 
 
-def ensure_public():
-    if PUBLIC.exists():
+def ensure_public(clean=True):
+    if PUBLIC.exists() and clean:
         try:
             shutil.rmtree(PUBLIC)
         except PermissionError:
@@ -83,171 +132,530 @@ def ensure_public():
             print("Por ejemplo: si estás ejecutando 'python -m http.server' en la carpeta 'public', detén ese servidor y vuelve a ejecutar el build.")
             print("En Windows puedes detener la ejecución con Ctrl+C en la terminal que lanzó el servidor o matar procesos 'python' si están en background.")
             raise
-    PUBLIC.mkdir(parents=True)
-    (PUBLIC / "wiki").mkdir()
-    (PUBLIC / "static").mkdir()
+    PUBLIC.mkdir(parents=True, exist_ok=True)
+    (PUBLIC / "wiki").mkdir(exist_ok=True)
+    (PUBLIC / "static").mkdir(exist_ok=True)
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def template_hash(page_assets):
+    """Hash of everything besides the sources that shapes the generated HTML,
+    including the fingerprinted names of the assets every page links to."""
+    payload = f"{BASE_HTML}{CARD_TEMPLATE}{json.dumps(page_assets, sort_keys=True)}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest():
+    """Returns the previous build manifest, or an empty one if it is missing,
+    unreadable or written by another BUILD_VERSION."""
+    empty = {"version": BUILD_VERSION, "template": None, "entries": {}, "assets": {}, "pages": None,
+             "search": None, "links": None}
+    if not MANIFEST.exists():
+        return empty
+    try:
+        with open(MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception:
+        return empty
+    if manifest.get("version") != BUILD_VERSION:
+        return empty
+    for key, value in empty.items():
+        manifest.setdefault(key, value)
+    return manifest
+
+
+def check_template(manifest, page_assets):
+    """Forces every page to be regenerated when the templates or the assets
+    they link to changed. Old outputs stay recorded so they can be pruned."""
+    current = template_hash(page_assets)
+    if manifest["template"] != current:
+        for record in manifest["entries"].values():
+            record["hash"] = None
+        manifest["pages"] = None
+        manifest["search"] = None
+        manifest["links"] = None
+        manifest["template"] = current
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST)
+
+
+def compress_output(path):
+    """Writes precompressed .gz (and .br) siblings next to a generated file."""
+    path = Path(path)
+    if path.suffix not in COMPRESSIBLE:
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    # mtime=0 keeps the .gz bytes reproducible between builds
+    with open(f"{path}.gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f"{path}.br", "wb") as f:
+            f.write(brotli.compress(data))
+
+
+def write_output(path, text):
+    """Writes a generated text file and its precompressed siblings."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    compress_output(path)
+
+
+def fingerprinted(rel, digest):
+    """static/x/style.css -> static/x/style.<hash>.css"""
+    path = Path(rel)
+    return path.with_name(f"{path.stem}.{digest[:12]}{path.suffix}").as_posix()
+
+
+def asset_url(url, assets=None):
+    """Returns the fingerprinted URL of an asset, or the URL unchanged."""
+    return (ASSET_URLS if assets is None else assets).get(url, url)
+
+
+def render_page(title, body, assets=None):
+    """Fills BASE_HTML and points its stylesheet links at the fingerprinted
+    assets. Worker processes pass `assets` since they don't share ASSET_URLS."""
+    out = BASE_HTML.format(title=title, body=body)
+    for url, hashed in (ASSET_URLS if assets is None else assets).items():
+        out = out.replace(f'href="{url}"', f'href="{hashed}"')
+    return out
+
+
+def remove_output(rel):
+    """Deletes a generated file, its precompressed siblings and any
+    directories it leaves empty."""
+    path = PUBLIC / rel
+    for candidate in (path, Path(f"{path}.gz"), Path(f"{path}.br")):
+        if candidate.exists():
+            candidate.unlink()
+    parent = path.parent
+    while parent != PUBLIC and parent.exists() and not any(parent.iterdir()):
+        parent.rmdir()
+        parent = parent.parent
 
 
 def load_metadata():
-    if DATAS.exists():
-        try:
-            with open(DATAS, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return []
-    return []
+    # wikis.json más las escrituras del journal que aún no se compactaron
+    return read_metadata(DATAS, DATAS_JOURNAL)
 
 
-def copy_static():
+def scan_static(manifest):
+    """Lists the static assets with their (mtime, size) stamp and content
+    hash. Hashes are reused from the manifest for unchanged files.
+    Returns {"static/<rel path>": {"src", "stamp", "hash"}}."""
+    previous = manifest["assets"]
+    assets = {}
     for src in STATIC_SRC:
         if not src.exists():
             continue
         for root, dirs, files in os.walk(src):
             rel = Path(root).relative_to(src)
-            target_dir = PUBLIC / "static" / rel
-            target_dir.mkdir(parents=True, exist_ok=True)
-            for file in files:
-                shutil.copy2(Path(root) / file, target_dir / file)
+            for file in sorted(files):
+                path = Path(root) / file
+                st = path.stat()
+                key = (Path("static") / rel / file).as_posix()
+                stamp = [st.st_mtime_ns, st.st_size]
+                record = previous.get(key)
+                digest = record["hash"] if record and record["stamp"] == stamp else file_hash(path)
+                assets[key] = {"src": str(path), "stamp": stamp, "hash": digest}
+    return assets
+
+
+def asset_urls(assets):
+    """Maps /static/... URLs to their fingerprinted versions."""
+    return {f"/{key}": f"/{fingerprinted(key, asset['hash'])}"
+            for key, asset in assets.items() if Path(key).suffix.lower() in FINGERPRINTED}
 
 
-def build_entries(meta):
+def copy_static(manifest, assets):
+    """Copies assets whose (mtime, size) changed since the last build, under
+    their own name and their fingerprinted name, and prunes copies of assets
+    that no longer exist. Returns the number copied."""
+    previous = manifest["assets"]
+    records = {}
+    copied = 0
+    for key, asset in assets.items():
+        outputs = [key]
+        if Path(key).suffix.lower() in FINGERPRINTED:
+            outputs.append(fingerprinted(key, asset["hash"]))
+        record = previous.get(key)
+        old_outputs = record.get("outputs", []) if record else []
+        records[key] = {"stamp": asset["stamp"], "hash": asset["hash"], "outputs": outputs}
+        if (record and record["stamp"] == asset["stamp"] and old_outputs == outputs
+                and all((PUBLIC / rel).exists() for rel in outputs)):
+            continue
+        for rel in outputs:
+            target = PUBLIC / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(asset["src"], target)
+            compress_output(target)
+        # Drop the previous fingerprinted copy
+        for rel in set(old_outputs) - set(outputs):
+            remove_output(rel)
+        copied += 1
+    for key in set(previous) - set(records):
+        for rel in previous[key].get("outputs", [key]):
+            remove_output(rel)
+    manifest["assets"] = records
+    return copied
+
+
+def render_entry(job):
+    """Renders one entry and writes its pages. Runs in a worker process when
+    building with --jobs, so it only takes and returns plain data.
+    Returns (title, error message or None, search term frequencies, linked
+    titles, {stage: seconds})."""
+    title, md_path, public, outputs, page_assets = job
+    timings = {}
+    try:
+        with open(md_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        # Sanitized with the same policy as the app's pages
+        html = render.render(content, render.collect(timings))
+        body = f"<h1>{title}</h1>\n" + html
+        out = render_page(title, body, page_assets)
+        for rel in outputs:
+            write_output(Path(public) / rel, out)
+    except Exception as exc:
+        return title, f"{type(exc).__name__}: {exc}", None, None, timings
+    return title, None, search_terms(title, content), extract_links(html), timings
+
+
+def search_terms(title, content):
+    """Term -> weighted frequency of an entry, as in the app's search index."""
+    counts = {}
+    for term in tokenize(content):
+        counts[term] = counts.get(term, 0) + 1
+    for term in tokenize(title):
+        counts[term] = counts.get(term, 0) + SEARCH_TITLE_WEIGHT
+    return counts
+
+
+def build_entries(meta, manifest, page_assets, executor=None):
+    """Renders entries whose source changed since the last build and removes
+    the pages of deleted entries. Rendering is fanned out to `executor` when
+    one is given. Returns (titles, title_to_slug, rendered, errors) where
+    errors maps title -> message for entries that failed to render."""
+    previous = manifest["entries"]
+    records = {}
     titles = []
     # Also return mapping from title -> slug
     title_to_slug = {}
-    for md in ENTRIES.glob("*.md"):
+    jobs = []
+    pending = {}
+    for md in sorted(ENTRIES.glob("*.md")):
         title = md.stem
         titles.append(title)
         slug = slugify(title)
         title_to_slug[title] = slug
-        with open(md, "r", encoding="utf-8") as f:
-            content = f.read()
-        html = markdown(content, extensions=["extra", "fenced_code"])
-        body = f"<h1>{title}</h1>\n" + html
-        out = BASE_HTML.format(title=title, body=body)
-        # create directory public/wiki/<slug>/index.html for pretty URLs
-        out_dir = PUBLIC / "wiki" / slug
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_path = out_dir / "index.html"
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(out)
-        # Also create legacy flat HTML filename to preserve old links
-        legacy_path = PUBLIC / "wiki" / f"{title}.html"
-        with open(legacy_path, "w", encoding="utf-8") as f:
-            f.write(out)
-    return titles, title_to_slug
+        source_hash = file_hash(md)
+        # pretty URL public/wiki/<slug>/index.html plus the legacy flat file
+        outputs = [f"wiki/{slug}/index.html", f"wiki/{title}.html"]
+        record = previous.get(title)
+        if (record and record["hash"] == source_hash and record["outputs"] == outputs
+                and all((PUBLIC / rel).exists() for rel in outputs)):
+            records[title] = record
+            continue
+        jobs.append((title, str(md), str(PUBLIC), outputs, page_assets))
+        pending[title] = {"hash": source_hash, "outputs": outputs}
+    # map() yields in submission order, so the outcome is deterministic
+    results = executor.map(render_entry, jobs, chunksize=8) if executor else map(render_entry, jobs)
+    errors = {}
+    for title, error, terms, links, timings in results:
+        for name, seconds in timings.items():
+            RENDER_TIMINGS[name] = RENDER_TIMINGS.get(name, 0.0) + seconds
+        if error:
+            # Leave it out of the manifest so the next build retries it
+            errors[title] = error
+            continue
+        records[title] = pending[title]
+        # Kept in the manifest so the search index never re-reads unchanged entries
+        records[title]["terms"] = terms
+        # Forward links, so links.json is rebuilt without re-rendering anything
+        records[title]["links"] = links
+        # Drop outputs the entry no longer produces (e.g. its slug changed)
+        old_outputs = previous[title]["outputs"] if title in previous else []
+        for rel in set(old_outputs) - set(records[title]["outputs"]):
+            remove_output(rel)
+    for title in set(previous) - set(titles):
+        for rel in previous[title]["outputs"]:
+            remove_output(rel)
+    manifest["entries"] = records
+    # Failed entries have no page, so keep them off the index
+    titles = [title for title in titles if title not in errors]
+    for title in errors:
+        del title_to_slug[title]
+    return titles, title_to_slug, len(jobs) - len(errors), errors
+
+
+def build_links(titles, manifest):
+    """Writes links.json with the backlinks of every entry and the links to
+    missing entries, from the forward links kept in the manifest, when they
+    changed. Returns the number of broken links."""
+    records = manifest["entries"]
+    existing = set(titles)
+    backlinks, broken = {}, {}
+    for title in titles:
+        for target in records[title].get("links") or []:
+            if target == title:
+                continue
+            (backlinks if target in existing else broken).setdefault(target, []).append(title)
+    data = {"backlinks": backlinks, "broken": broken}
+    signature = hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    if signature != manifest["links"] or not (PUBLIC / "links.json").exists():
+        write_json(PUBLIC / "links.json", data)
+        manifest["links"] = signature
+    return sum(len(sources) for sources in broken.values())
+
+
+def pages_hash(titles, meta):
+    """Hash of the inputs of the index, search and random pages: the title
+    set, the metadata and the (fingerprinted) card images."""
+    payload = json.dumps([titles, meta, ASSET_URLS], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def index_page_url(number):
+    return "/" if number == 1 else f"/index/page-{number}/"
 
 
 def build_index(titles, meta, title_to_slug):
-    # build cards
+    """Writes the card index in pages of INDEX_PAGE_SIZE cards and removes
+    pages left over from a larger catalog."""
     meta_map = {m.get("title", ""): m for m in meta}
-    cards = []
-    for t in titles:
+    total = max(1, -(-len(titles) // INDEX_PAGE_SIZE))
+    for number in range(1, total + 1):
+        cards = []
+        for t in titles[(number - 1) * INDEX_PAGE_SIZE:number * INDEX_PAGE_SIZE]:
+            m = meta_map.get(t, {})
+            # If metadata doesn't include an image_url, use the registered image
+            img_url = m.get('image_url', '') or IMAGES.card_url(t) or ''
+            slug = title_to_slug.get(t, slugify(t))
+            cards.append(CARD_TEMPLATE.format(img_url=asset_url(img_url), title=t, title_lower=t.lower(), category=m.get('category','-'), author=m.get('author','-'), url_title=slug))
+        links = []
+        if number > 1:
+            links.append(f'<a href="{index_page_url(number - 1)}">&laquo; Anterior</a>')
+        if number < total:
+            links.append(f'<a href="{index_page_url(number + 1)}">Siguiente &raquo;</a>')
+        pager = f'<nav class="pager">{" ".join(links)} <span>{number} / {total}</span></nav>' if total > 1 else ''
+        body = '<h1>Wiki</h1>\n<div class="cards">' + '\n'.join(cards) + '</div>' + pager
+        out = render_page("Index" if number == 1 else f"Index ({number})", body)
+        write_output(PUBLIC / ("index.html" if number == 1 else f"index/page-{number}/index.html"), out)
+    pages_dir = PUBLIC / "index"
+    if pages_dir.exists():
+        for page in pages_dir.iterdir():
+            number = page.name.removeprefix("page-")
+            if page.is_dir() and number.isdigit() and int(number) > total:
+                remove_output(Path("index") / page.name / "index.html")
+
+
+def search_hash(titles, meta, records):
+    """Hash of the inputs of the search index: pages_hash plus the source
+    hash of every entry."""
+    payload = json.dumps([pages_hash(titles, meta), [records[t]["hash"] for t in titles]])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def shard_name(term):
+    """search/shards/<name>.json holding `term`: the code points of its
+    first characters in hex, so file names stay ASCII (the page computes
+    the same name in JavaScript)."""
+    return "-".join(f"{ord(ch):x}" for ch in term[:SEARCH_SHARD_PREFIX])
+
+
+def write_json(path, data):
+    write_output(path, json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True))
+
+
+def build_search_index(titles, title_to_slug, meta, records, version):
+    """Writes the search index as shards by term prefix. Each shard holds
+    its postings {term: [[doc, tf], ...]}, the card row of every entry they
+    mention and the corpus statistics BM25 needs, so a query downloads only
+    the shards of its terms. Shards left from a previous build are removed."""
+    meta_map = {m.get("title", ""): m for m in meta}
+    rows = []
+    shards = {}
+    for doc, t in enumerate(titles):
         m = meta_map.get(t, {})
-        img_url = m.get('image_url', '')
-        # If metadata doesn't include an image_url, try to find a matching image
-        if not img_url:
-            image_dir = ROOT / 'encyclopedia' / 'static' / 'images'
-            if image_dir.exists():
-                for ext in ('.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp'):
-                    cand = image_dir / f"{t}{ext}"
-                    if cand.exists():
-                        img_url = f"/static/images/{cand.name}"
-                        break
-        slug = title_to_slug.get(t, slugify(t))
-        cards.append(CARD_TEMPLATE.format(img_url=img_url, title=t, title_lower=t.lower(), category=m.get('category','-'), author=m.get('author','-'), url_title=slug))
-    body = '<h1>Wiki</h1>\n<div class="cards">' + '\n'.join(cards) + '</div>'
-    out = BASE_HTML.format(title="Index", body=body)
-    with open(PUBLIC / "index.html", "w", encoding="utf-8") as f:
-        f.write(out)
-
-
-def build_search_page(titles, title_to_slug, meta):
-        meta_map = {m.get("title", ""): m for m in meta}
-        cards_html = []
-        for t in titles:
-                m = meta_map.get(t, {})
-                img_url = m.get('image_url', '')
-                if not img_url:
-                        image_dir = ROOT / 'encyclopedia' / 'static' / 'images'
-                        if image_dir.exists():
-                                for ext in ('.webp', '.png', '.jpg', '.jpeg', '.gif', '.bmp'):
-                                        cand = image_dir / f"{t}{ext}"
-                                        if cand.exists():
-                                                img_url = f"/static/images/{cand.name}"
-                                                break
-                slug = title_to_slug.get(t, slugify(t))
-                cards_html.append(CARD_TEMPLATE.format(img_url=img_url, title=t, title_lower=t.lower(), category=m.get('category','-'), author=m.get('author','-'), url_title=slug))
-        search_body = '<h1>Search</h1>\n<p id="msg"></p>\n<div id="cards" class="cards">' + '\n'.join(cards_html) + '</div>'
-        search_html = BASE_HTML.format(title="Search", body=search_body)
-        script = """
+        img_url = m.get('image_url', '') or IMAGES.card_url(t) or ''
+        terms = records[t].get("terms") or {}
+        rows.append([t, title_to_slug[t], m.get('category', '-'), m.get('author', '-'),
+                     asset_url(img_url), sum(terms.values())])
+        for term, tf in terms.items():
+            shard = shards.setdefault(shard_name(term), {"postings": {}, "docs": {}})
+            shard["postings"].setdefault(term, []).append([doc, tf])
+            shard["docs"][doc] = rows[doc]
+    average = sum(row[5] for row in rows) / (len(rows) or 1)
+    search_dir = PUBLIC / "search"
+    for name, shard in shards.items():
+        write_json(search_dir / "shards" / f"{name}.json", {"n": len(rows), "avg": average, **shard})
+    if (search_dir / "shards").exists():
+        for path in (search_dir / "shards").glob("*.json"):
+            if path.stem not in shards:
+                remove_output(path.relative_to(PUBLIC))
+    # Builds before the shards were self-contained wrote every row here
+    remove_output(Path("search") / "docs.json")
+    build_search_page(version)
+
+
+SEARCH_SCRIPT = """
 <script>
     (function(){
-        const params = new URLSearchParams(window.location.search);
-        const q = (params.get('q') || '').toLowerCase();
-        const cards = Array.from(document.querySelectorAll('.card'));
-        if(!q){
-            document.getElementById('msg').textContent = 'Use the search box to filter entries.';
+        const VERSION = '__VERSION__';
+        const K1 = 1.2, B = 0.75;
+        const msg = document.getElementById('msg');
+        const q = new URLSearchParams(window.location.search).get('q') || '';
+        const norm = s => s.normalize('NFKD').replace(/\\p{M}/gu, '').toLowerCase();
+        const terms = [...new Set(norm(q).match(/[\\p{L}\\p{N}_]+/gu) || [])];
+        if(!terms.length){
+            msg.textContent = 'Use the search box to filter entries.';
             return;
         }
-        let found = 0;
-        cards.forEach(c=>{
-            const title = c.getAttribute('data-title') || '';
-            if(title.includes(q)){
-                c.style.display = '';
-                found++;
-            } else {
-                c.style.display = 'none';
+        const shardOf = t => [...t].slice(0, 2).map(c => c.codePointAt(0).toString(16)).join('-');
+        const load = url => fetch(url + '?v=' + VERSION).then(r => r.ok ? r.json() : {}).catch(() => ({}));
+        const names = [...new Set(terms.map(shardOf))];
+        // Only the shards of the query terms are downloaded; each carries
+        // the rows of the entries it mentions
+        Promise.all(names.map(n => load('/search/shards/' + n + '.json'))).then(loaded => {
+            const shards = Object.fromEntries(names.map((n, i) => [n, loaded[i].postings || {}]));
+            const docs = Object.assign({}, ...loaded.map(shard => shard.docs || {}));
+            const stats = loaded.find(shard => shard.n) || {n: 0, avg: 1};
+            const scores = new Map();
+            terms.forEach(term => {
+                const postings = shards[shardOf(term)] || {};
+                // Whole-word hits count fully; longer words starting with the term count half
+                const keys = term.length >= 2 ? Object.keys(postings).filter(k => k.startsWith(term)) : (postings[term] ? [term] : []);
+                keys.forEach(key => {
+                    const list = postings[key];
+                    const idf = Math.log(1 + (stats.n - list.length + 0.5) / (list.length + 0.5));
+                    const factor = key === term ? 1 : 0.5;
+                    list.forEach(([doc, tf]) => {
+                        const norm = K1 * (1 - B + B * docs[doc][5] / stats.avg);
+                        scores.set(doc, (scores.get(doc) || 0) + factor * idf * tf * (K1 + 1) / (tf + norm));
+                    });
+                });
+            });
+            // Partial title matches (e.g. "Djan") rank first; titles are
+            // indexed too, so they are among the entries already loaded
+            const needle = norm(q).trim();
+            scores.forEach((score, doc) => {
+                if(norm(docs[doc][0]).includes(needle)) scores.set(doc, score + 1000);
+            });
+            const found = [...scores.keys()].sort((a, b) => scores.get(b) - scores.get(a) || (docs[a][0] < docs[b][0] ? -1 : 1));
+            msg.textContent = found.length ? found.length + ' results' : 'No results';
+            if(found.length === 1){
+                window.location.href = '/wiki/' + docs[found[0]][1];
+                return;
             }
+            const esc = s => String(s).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+            document.getElementById('cards').innerHTML = found.map(doc => {
+                const [title, slug, category, author, img] = docs[doc];
+                return '<div class="card" data-title="' + esc(title.toLowerCase()) + '">' +
+                    '<div class="card__img" style="background-image: url(\\'' + esc(img) + '\\')"></div>' +
+                    '<div class="card__img--hover" style="background-image: url(\\'' + esc(img) + '\\')"></div>' +
+                    '<div class="card__info"><p class="card__category">' + esc(category) + '</p>' +
+                    '<h3 class="card__title">' + esc(title) + '</h3>' +
+                    '<p class="card__by">By <span class="card__author">' + esc(author) + '</span></p>' +
+                    '<a class="ct" href="/wiki/' + esc(slug) + '">Ver</a></div></div>';
+            }).join('\\n');
         });
-        document.getElementById('msg').textContent = found ? found + ' results' : 'No results';
-        if(found === 1){
-            const visible = cards.find(c=>c.style.display !== 'none');
-            const a = visible && visible.querySelector('a');
-            if(a) window.location.href = a.href;
-        }
     })();
 </script>
 """
+
+
+def build_search_page(version):
+        search_body = '<h1>Search</h1>\n<p id="msg"></p>\n<div id="cards" class="cards"></div>'
+        search_html = render_page("Search", search_body)
+        script = SEARCH_SCRIPT.replace("__VERSION__", version[:12])
         search_html = search_html.replace('</body>', script + '\n</body>')
-        out_dir = PUBLIC / 'search'
-        out_dir.mkdir(parents=True, exist_ok=True)
-        with open(out_dir / 'index.html', 'w', encoding='utf-8') as f:
-                f.write(search_html)
+        write_output(PUBLIC / 'search' / 'index.html', search_html)
 
 
 def build_newpage(meta):
         body = '<h1>Create New Page</h1>\n<p>This is a static copy of the new page form. To add entries, edit the Markdown files in the <code>entries/</code> folder or use the dynamic Django app.</p>'
         body += '<form><input placeholder="Title"><br><textarea placeholder="Content"></textarea><br><button disabled>Submit (not available in static)</button></form>'
-        out = BASE_HTML.format(title='Create New Page', body=body)
-        with open(PUBLIC / 'newpage.html', 'w', encoding='utf-8') as f:
-                f.write(out)
+        out = render_page('Create New Page', body)
+        write_output(PUBLIC / 'newpage.html', out)
 
 
 def build_random_page(title_to_slug):
         slugs = [title_to_slug[t] for t in title_to_slug]
         script = '<script>const s=' + json.dumps(slugs) + '; location.href = \'/wiki/\' + s[Math.floor(Math.random()*s.length)];</script>'
         body = '<h1>Random page</h1>' + script
-        out = BASE_HTML.format(title='Random', body=body)
-        with open(PUBLIC / 'random.html', 'w', encoding='utf-8') as f:
-                f.write(out)
+        out = render_page('Random', body)
+        write_output(PUBLIC / 'random.html', out)
+
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera el sitio estático en public/")
+    parser.add_argument("--full", action="store_true", help="borra public/ y reconstruye todo")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="procesos para renderizar entradas (0 = uno por CPU)")
+    args = parser.parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
 
-def main():
-    ensure_public()
+    ensure_public(clean=args.full)
+    manifest = load_manifest()
     meta = load_metadata()
-    copy_static()
-    titles, title_to_slug = build_entries(meta)
-    build_index(titles, meta, title_to_slug)
-    # auxiliary static pages
-    try:
-        build_search_page(titles, title_to_slug, meta)
-        build_newpage(meta)
-        build_random_page(title_to_slug)
-    except Exception:
-        # If auxiliary page generation fails, print and continue
-        print('Warning: failed to generate auxiliary static pages')
-    print(f"Built static site at {PUBLIC}")
+    IMAGES.refresh()
+    assets = scan_static(manifest)
+    ASSET_URLS.clear()
+    RENDER_TIMINGS.clear()
+    ASSET_URLS.update(asset_urls(assets))
+    # Only the assets BASE_HTML links to are shipped to the render workers
+    page_assets = {url: hashed for url, hashed in ASSET_URLS.items() if f'"{url}"' in BASE_HTML}
+    check_template(manifest, page_assets)
+    # Assets are copied on a thread while the entries render
+    with ThreadPoolExecutor(max_workers=1) as io_pool:
+        copying = io_pool.submit(copy_static, manifest, assets)
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                titles, title_to_slug, rendered, errors = build_entries(meta, manifest, page_assets, pool)
+        else:
+            titles, title_to_slug, rendered, errors = build_entries(meta, manifest, page_assets)
+        copied = copying.result()
+    signature = pages_hash(titles, meta)
+    pages = ["index.html", "newpage.html", "random.html"]
+    if signature != manifest["pages"] or not all((PUBLIC / rel).exists() for rel in pages):
+        build_index(titles, meta, title_to_slug)
+        # auxiliary static pages
+        try:
+            build_newpage(meta)
+            build_random_page(title_to_slug)
+            manifest["pages"] = signature
+        except Exception:
+            # If auxiliary page generation fails, print and continue
+            print('Warning: failed to generate auxiliary static pages')
+            manifest["pages"] = None
+    search_signature = search_hash(titles, meta, manifest["entries"])
+    search_outputs = ["search/index.html"]
+    if (search_signature != manifest["search"]
+            or not all((PUBLIC / rel).exists() for rel in search_outputs)):
+        build_search_index(titles, title_to_slug, meta, manifest["entries"], search_signature)
+        manifest["search"] = search_signature
+    broken = build_links(titles, manifest)
+    save_manifest(manifest)
+    print(f"Built static site at {PUBLIC} ({rendered} entries rendered, {copied} assets copied)")
+    if RENDER_TIMINGS:
+        print("Render: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in RENDER_TIMINGS.items()))
+    if broken:
+        print(f"Warning: {broken} enlaces a entradas inexistentes (ver public/links.json)")
+    for title, error in sorted(errors.items()):
+        print(f"ERROR: no se pudo generar '{title}': {error}")
+    return 1 if errors else 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Entry, EntryMeta
+
+
+@admin.register(Entry)
+class EntryAdmin(admin.ModelAdmin):
+    list_display = ("title", "size", "updated")
+    search_fields = ("title",)
+
+
+@admin.register(EntryMeta)
+class EntryMetaAdmin(admin.ModelAdmin):
+    list_display = ("title", "category", "author", "updated")
+    search_fields = ("title", "category", "author")
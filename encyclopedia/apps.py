@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EncyclopediaConfig(AppConfig):
     name = 'encyclopedia'
+    default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        # Connect the entry_saved and entry_deleted receivers
+        from . import links, search  # noqa: F401
+        if getattr(settings, "WIKI_WARM_CACHE", False):
+            # Pre-render in the background so the first visitors get cached pages
+            from . import warmup
+            warmup.start()
@@ -0,0 +1,137 @@
+"""
+Async versions of the read views, routed instead of views.py when
+WIKI_ASYNC_VIEWS is on (wiki/asgi.py turns it on).
+
+Nothing here blocks the event loop: storage reads, ETag computation and
+metadata lookups run in worker threads (util.offload), while Markdown and
+template rendering run on the bounded render executor. Concurrent requests
+for the same uncached page share a single render (util.aget_entry_html).
+newpage, edit_entry, the link reports and the revision history are the
+regular views; Django runs them in a thread.
+"""
+import functools
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import never_cache
+
+from . import util, views
+from .views import (  # noqa: F401 (sync views, same URLs)
+    backlinks, broken_links, diff, edit_entry, history, newpage, revision, wiki_section,
+)
+
+
+def acondition(etag_func=None, last_modified_func=None):
+    """
+    condition() for async views. The ETag and Last-Modified functions stat
+    (and may hash) files, so they run in a worker thread.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def inner(request, *args, **kwargs):
+            def validators():
+                etag = etag_func(request, *args, **kwargs) if etag_func else None
+                modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+                return etag, modified
+
+            etag, modified = await util.offload(validators)()
+            etag = quote_etag(etag) if etag is not None else None
+            modified = int(modified.timestamp()) if modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+        return inner
+    return decorator
+
+
+async def _render(request, template, context):
+    return await util.run_rendering(views.render, request, template, context)
+
+
+@views._cacheable("index")
+@acondition(etag_func=views._index_etag)
+async def index(request):
+    context = await util.offload(views._index_context)(request)
+    return await _render(request, "encyclopedia/index.html", context)
+
+
+@views._cacheable("index")
+@acondition(etag_func=views._index_etag)
+async def index_all(request):
+    filters = views._index_filters(request)
+    page = await util.run_rendering(render_to_string, "encyclopedia/index.html", {
+        "stream": True, "stream_marker": views.STREAM_MARKER, "filters": filters}, request)
+    head, tail = page.split(views.STREAM_MARKER, 1)
+
+    async def cards():
+        yield head
+        cursor = None
+        while True:
+            cards, cursor = await util.offload(views._index_page)(cursor, filters)
+            yield cards
+            if cursor is None:
+                break
+        yield tail
+
+    return StreamingHttpResponse(cards())
+
+
+@views._cacheable("wiki")
+@acondition(etag_func=views._wiki_etag)
+async def wiki(request, title):
+    if "full" not in request.GET:
+        digest, sections = await util.aget_entry_sections(title)
+        if sections is not None:
+            context = await util.run_rendering(views._sections_context, title, digest, sections)
+            response = await _render(request, "encyclopedia/wiki.html", context)
+            return await util.offload(views._tag_rendering)(request, response, title, digest)
+    digest, content = await util.aget_entry_rendering(title)
+    if content is None:
+        return await _render(request, "encyclopedia/wiki.html", {
+            "title": title,
+            "wikis": "Enciclopedia no encontrada :(..."
+        })
+    response = await _render(request, "encyclopedia/wiki.html", {
+        "title": title,
+        "history": await util.offload(views._has_history)(title),
+        "wikis": mark_safe(content)
+    })
+    return await util.offload(views._tag_rendering)(request, response, title, digest)
+
+
+@views._cacheable("search")
+@acondition(etag_func=views._search_etag)
+async def search(request):
+    query = request.GET.get("q", "")
+    content = await util.aget_entry_html(query)
+    if content is not None:
+        return await _render(request, "encyclopedia/wiki.html", {
+            "wikis": mark_safe(content), "title": query,
+            "history": await util.offload(views._has_history)(query),
+        })
+    results = await util.offload(views._search_results)(query)
+    if not results:
+        return await _render(request, "encyclopedia/results.html", {
+            "results": "No results :(..."
+        })
+    return await _render(request, "encyclopedia/results.html", {
+        "cards": await util.offload(views._results_cards)(results),
+    })
+
+
+@never_cache
+async def randpage(request):
+    selection = await util.arandom_entry()
+    if selection is None:
+        return redirect("index")
+    return redirect("wiki", title=selection)
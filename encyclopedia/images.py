@@ -0,0 +1,221 @@
+"""
+Responsive card images.
+
+Uploaded images are re-encoded off the request thread into WEBP (and AVIF,
+when Pillow supports it) variants at a few card widths, with EXIF and other
+metadata stripped. The variant URLs are recorded in the entry metadata under
+"images", so the card grid can pick the smallest file that still fills a card.
+
+Which image belongs to which title is answered by an ImageRegistry: one
+directory scan mapping title -> original and variants, shared by the views and
+the static builder. It has no Django dependencies.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+IMAGE_DIR = "encyclopedia/static/images"
+VARIANT_DIR = os.path.join(IMAGE_DIR, "variants")
+IMAGE_URL = "/static/images"
+SOURCE_EXTENSIONS = [".webp", ".jpg", ".jpeg", ".png", ".gif", ".bmp"]
+
+# Cards are at most 360px wide (see stylecards.css); 720 covers 2x screens
+CARD_WIDTH = 360
+CARD_WIDTHS = (320, 480, 720)
+
+# (format key, Pillow format, save options), best compression last
+FORMATS = [("webp", "WEBP", {"quality": 80, "method": 6})]
+if features.check("avif"):
+    FORMATS.append(("avif", "AVIF", {"quality": 60}))
+
+IMAGE_WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImageRegistry:
+    """
+    Title -> image lookup built from a single scan of the image directory and
+    its variants/ subdirectory. The scan is redone when invalidate() is called
+    or when either directory's mtime changes (e.g. another worker uploaded).
+    """
+
+    def __init__(self, image_dir=IMAGE_DIR, url=IMAGE_URL):
+        self.image_dir = str(image_dir)
+        self.variant_dir = os.path.join(self.image_dir, "variants")
+        self.url = url
+        self.stamp = None
+        self.originals = {}
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    def _stamp(self):
+        stamp = []
+        for path in (self.image_dir, self.variant_dir):
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _scan(self):
+        originals = {}
+        if os.path.isdir(self.image_dir):
+            rank = {ext: i for i, ext in enumerate(SOURCE_EXTENSIONS)}
+            for item in os.scandir(self.image_dir):
+                title, ext = os.path.splitext(item.name)
+                ext = ext.lower()
+                if ext not in rank or not item.is_file():
+                    continue
+                best = originals.get(title)
+                if best is None or rank[ext] < rank[os.path.splitext(best)[1].lower()]:
+                    originals[title] = item.name
+        variants = {}
+        if os.path.isdir(self.variant_dir):
+            for item in os.scandir(self.variant_dir):
+                stem, _, key = item.name.rpartition(".")
+                title, _, width = stem.rpartition("-")
+                if not width.isdigit():
+                    continue
+                urls = variants.setdefault(title, {}).setdefault(key, {})
+                urls[width] = f"{self.url}/variants/{item.name}"
+        return originals, variants
+
+    def refresh(self):
+        """
+        Rescans if the directories changed since the last scan. One stat per
+        directory, so call it once per request rather than once per title.
+        """
+        stamp = self._stamp()
+        with self.lock:
+            if stamp == self.stamp:
+                return self
+        originals, variants = self._scan()
+        with self.lock:
+            self.originals, self.variants, self.stamp = originals, variants, stamp
+        return self
+
+    def version(self):
+        """
+        Returns the directory stamp; changes whenever an image is added,
+        replaced or removed.
+        """
+        return self._stamp()
+
+    def invalidate(self):
+        with self.lock:
+            self.stamp = None
+
+    def source(self, title):
+        """
+        Returns the filesystem path of the original image, or None.
+        """
+        name = self.originals.get(title)
+        return os.path.join(self.image_dir, name) if name else None
+
+    def original_url(self, title):
+        name = self.originals.get(title)
+        return f"{self.url}/{name}" if name else None
+
+    def card_url(self, title):
+        """
+        Returns the smallest variant that fills a card, else the original.
+        """
+        return pick_variant(self.variants.get(title)) or self.original_url(title)
+
+    def image_set(self, title):
+        return image_set(self.variants.get(title))
+
+
+# Registry of the Django app's images (paths relative to the project root)
+registry = ImageRegistry()
+
+
+def find_source(title):
+    """
+    Returns the path of the original image uploaded for an entry, or None.
+    """
+    return registry.refresh().source(title)
+
+
+def generate_variants(title, source=None):
+    """
+    Writes the resized variants of an entry's image and returns
+    {format: {width: url}}, or None if the entry has no image. Pass `source`
+    (the original's path) to skip the registry lookup.
+    """
+    source = source or find_source(title)
+    if source is None:
+        return None
+    os.makedirs(VARIANT_DIR, exist_ok=True)
+    with Image.open(source) as original:
+        img = ImageOps.exif_transpose(original)
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    # Never upscale: widths beyond the original collapse into one full-size variant
+    widths = sorted({min(width, img.width) for width in CARD_WIDTHS})
+    variants = {key: {} for key, _, _ in FORMATS}
+    for width in widths:
+        resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        # Drop EXIF, ICC, XMP and friends
+        resized.info = {}
+        for key, fmt, options in FORMATS:
+            name = f"{title}-{width}.{key}"
+            resized.save(os.path.join(VARIANT_DIR, name), fmt, **options)
+            variants[key][str(width)] = f"{IMAGE_URL}/variants/{name}"
+    registry.invalidate()
+    return variants
+
+
+def process_image(title):
+    """
+    Generates the variants for an entry and records them in its metadata.
+    """
+    from . import util
+
+    variants = generate_variants(title)
+    if variants:
+        util.update_data(title, images=variants)
+    return variants
+
+
+def schedule_variants(title):
+    """
+    Queues variant generation on the image worker pool and returns the Future.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+    return _executor.submit(process_image, title)
+
+
+def pick_variant(variants, width=CARD_WIDTH, key="webp"):
+    """
+    Returns the URL of the smallest variant at least `width` pixels wide,
+    falling back to the widest one available.
+    """
+    urls = (variants or {}).get(key)
+    if not urls:
+        return None
+    widths = sorted(int(w) for w in urls)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return urls[str(chosen)]
+
+
+def image_set(variants, width=CARD_WIDTH):
+    """
+    Returns a CSS image-set() value serving AVIF where supported and a
+    sharper variant on 2x screens, or None without variants.
+    """
+    candidates = []
+    for key, _, _ in reversed(FORMATS):
+        for density in (1, 2):
+            url = pick_variant(variants, width * density, key)
+            if url:
+                candidates.append(f"url('{url}') type('image/{key}') {density}x")
+    if not candidates:
+        return None
+    return f"image-set({', '.join(candidates)})"
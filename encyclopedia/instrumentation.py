@@ -0,0 +1,233 @@
+"""
+Opt-in request instrumentation (WIKI_INSTRUMENTATION setting).
+
+Hot paths are wrapped in named stages ("storage.read", "markdown", "bleach",
+"metadata", "template", ...). While a request is being served, each stage's
+time is added to the request's timings, which the middleware returns in a
+Server-Timing header; every stage and view also feeds an in-process latency
+histogram, exposed as JSON (or Prometheus text) by the metrics view.
+
+A request can be profiled with cProfile by sending `?_profile=<token>` (the
+stats replace the response) or `X-Wiki-Profile: <token>`; a random sample
+of requests (WIKI_PROFILE_SAMPLE_RATE) is profiled into WIKI_PROFILE_DIR.
+With DEBUG on, any token is accepted. When instrumentation is off, the
+stage wrappers cost one settings lookup and the middleware is not loaded.
+"""
+import cProfile
+import contextvars
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse, JsonResponse
+
+# Upper bounds (ms) of the histogram buckets; the last one catches the rest
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+# Timings of the request being served: stage -> [total ms, calls]
+_timings = contextvars.ContextVar("wiki_timings", default=None)
+
+# (kind, name) -> {"buckets": [...], "count", "sum"}
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, "WIKI_INSTRUMENTATION", False)
+
+
+def observe(kind, name, ms):
+    """
+    Adds one latency sample to the (kind, name) histogram.
+    """
+    with _histograms_lock:
+        histogram = _histograms.get((kind, name))
+        if histogram is None:
+            histogram = _histograms[(kind, name)] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        histogram["buckets"][next(i for i, bound in enumerate(BUCKETS) if ms <= bound)] += 1
+        histogram["count"] += 1
+        histogram["sum"] += ms
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block as stage `name`.
+    """
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        observe("stage", name, ms)
+        timings = _timings.get()
+        if timings is not None:
+            total = timings.setdefault(name, [0.0, 0])
+            total[0] += ms
+            total[1] += 1
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as stage `name`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _authorized(token):
+    if not token:
+        return False
+    expected = getattr(settings, "WIKI_PROFILE_TOKEN", "")
+    return settings.DEBUG or (expected and token == expected)
+
+
+def _server_timing(timings, total_ms):
+    metrics = [f'{name.replace(".", "-")};dur={ms:.2f};desc="{name} x{calls}"'
+               for name, (ms, calls) in timings.items()]
+    metrics.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(metrics)
+
+
+class InstrumentationMiddleware:
+    """
+    Collects stage timings per request, adds the Server-Timing header and
+    records the view latency. Put it first in MIDDLEWARE so the header
+    covers the whole stack. Works in sync and async stacks; under ASGI a
+    profile also sees whatever else the event loop ran meanwhile.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _begin(self, request):
+        explicit = _authorized(request.GET.get("_profile") or request.headers.get("X-Wiki-Profile"))
+        sampled = not explicit and random.random() < getattr(settings, "WIKI_PROFILE_SAMPLE_RATE", 0)
+        profiler = cProfile.Profile() if explicit or sampled else None
+        return explicit, sampled, profiler, _timings.set({}), time.perf_counter()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        explicit, sampled, profiler, token, start = self._begin(request)
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+            return self._end(request, response, explicit, sampled, profiler, start)
+        finally:
+            _timings.reset(token)
+
+    async def __acall__(self, request):
+        explicit, sampled, profiler, token, start = self._begin(request)
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            return self._end(request, response, explicit, sampled, profiler, start)
+        finally:
+            _timings.reset(token)
+
+    def _end(self, request, response, explicit, sampled, profiler, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        timings = _timings.get()
+        match = getattr(request, "resolver_match", None)
+        observe("view", match.url_name if match and match.url_name else "other", total_ms)
+        response["Server-Timing"] = _server_timing(timings, total_ms)
+        if explicit:
+            return self._profile_response(profiler)
+        if sampled:
+            self._save_profile(profiler, request, total_ms)
+        return response
+
+    def _profile_response(self, profiler):
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        return HttpResponse(out.getvalue(), content_type="text/plain; charset=utf-8")
+
+    def _save_profile(self, profiler, request, total_ms):
+        directory = getattr(settings, "WIKI_PROFILE_DIR", None)
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        name = request.path.strip("/").replace("/", "_") or "index"
+        profiler.dump_stats(os.path.join(directory, f"{time.time():.0f}-{total_ms:.0f}ms-{name[:60]}.prof"))
+
+
+def snapshot():
+    """
+    Returns a copy of the histograms: {kind: {name: {...}}}.
+    """
+    data = {}
+    with _histograms_lock:
+        for (kind, name), histogram in sorted(_histograms.items()):
+            data.setdefault(kind, {})[name] = {
+                "count": histogram["count"],
+                "sum_ms": round(histogram["sum"], 3),
+                "buckets": {("+Inf" if bound == float("inf") else str(bound)): count
+                            for bound, count in zip(BUCKETS, histogram["buckets"])},
+            }
+    return data
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def _prometheus(data):
+    lines = []
+    for kind, histograms in data.items():
+        metric = f"wiki_{kind}_duration_ms"
+        lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in histograms.items():
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{kind}="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{kind}="{name}"}} {histogram["sum_ms"]}')
+            lines.append(f'{metric}_count{{{kind}="{name}"}} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def metrics(request):
+    """
+    Latency histograms of this process, per view and per stage. Only served
+    with instrumentation on, to DEBUG or to WIKI_PROFILE_TOKEN holders.
+    """
+    if not enabled() or not _authorized(request.GET.get("token") or request.headers.get("X-Wiki-Profile") or "-"):
+        raise Http404
+    data = snapshot()
+    if request.GET.get("format") == "prometheus":
+        return HttpResponse(_prometheus(data), content_type="text/plain; version=0.0.4")
+    return JsonResponse(data, json_dumps_params={"indent": 1})
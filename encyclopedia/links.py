@@ -0,0 +1,173 @@
+"""
+Link graph between encyclopedia entries.
+
+The /wiki/<title> links in each entry's Markdown source are recorded as its
+forward links (no rendering needed); the backward adjacency (who links to
+a title) is derived from them in memory. Only the forward lists are
+persisted, to datas/link_graph.json with the (mtime, size) stamp each entry
+was read at, so a restart only re-reads entries that changed on disk.
+Backlinks and broken links are then answered from the graph alone.
+"""
+import threading
+
+from django.dispatch import receiver
+
+from . import util
+from .persisted import PersistedIndex
+from .signals import entry_deleted, entry_saved
+from .text import extract_markdown_links
+
+GRAPH_PATH = "datas/link_graph.json"
+GRAPH_FORMAT = 2
+
+
+class LinkGraph:
+    """
+    Forward (title -> [linked titles]) and backward (title -> {linking
+    titles}) adjacency of the entries.
+    """
+
+    def __init__(self):
+        # title -> (stamp, [targets])
+        self.forward = {}
+        self.backward = {}
+        self.lock = threading.Lock()
+
+    def update(self, title, targets, stamp=None):
+        """
+        Sets the links of an entry. Returns True if they changed.
+        """
+        targets = [target for target in targets if target != title]
+        with self.lock:
+            previous = self.forward.get(title)
+            if previous is not None and previous[1] == targets:
+                self.forward[title] = (stamp, targets)
+                return False
+            self._remove(title)
+            self._insert(title, stamp, targets)
+        return True
+
+    def remove(self, title):
+        with self.lock:
+            self._remove(title)
+
+    def _insert(self, title, stamp, targets):
+        self.forward[title] = (stamp, targets)
+        for target in targets:
+            self.backward.setdefault(target, set()).add(title)
+
+    def _remove(self, title):
+        previous = self.forward.pop(title, None)
+        if previous is None:
+            return
+        for target in previous[1]:
+            sources = self.backward.get(target)
+            if sources is not None:
+                sources.discard(title)
+                if not sources:
+                    del self.backward[target]
+
+    def backlinks(self, title):
+        """
+        Returns the titles linking to `title`, sorted.
+        """
+        with self.lock:
+            return sorted(self.backward.get(title, ()))
+
+    def broken(self, titles):
+        """
+        Returns {missing title: [titles linking to it]} given the existing titles.
+        """
+        existing = set(titles)
+        with self.lock:
+            return {target: sorted(sources) for target, sources in sorted(self.backward.items())
+                    if target not in existing}
+
+    def sync(self):
+        """
+        Brings the graph up to date with the stored entries, re-reading
+        only entries whose stamp changed. Returns True if anything changed.
+        """
+        titles = util.list_entries()
+        changed = False
+        for title in set(self.forward) - set(titles):
+            self.remove(title)
+            changed = True
+        for title in titles:
+            stamp = util.entry_stamp(title)
+            doc = self.forward.get(title)
+            if doc is not None and doc[0] == stamp:
+                continue
+            content = util.get_entry(title)
+            if content is None:
+                continue
+            self.update(title, extract_markdown_links(content), stamp)
+            changed = True
+        return changed
+
+    def dump(self):
+        with self.lock:
+            docs = {title: [list(stamp) if stamp else None, targets]
+                    for title, (stamp, targets) in self.forward.items()}
+        return {"format": GRAPH_FORMAT, "docs": docs}
+
+    @classmethod
+    def from_dump(cls, data):
+        graph = cls()
+        if data.get("format") != GRAPH_FORMAT:
+            return graph
+        for title, (stamp, targets) in data.get("docs", {}).items():
+            graph._insert(title, tuple(stamp) if stamp else None, targets)
+        return graph
+
+
+# Process-wide graph, loaded lazily and written back after updates
+_store = PersistedIndex(GRAPH_PATH, LinkGraph)
+
+
+def get_graph():
+    """
+    Returns the process-wide link graph, loading it on first use and
+    reloading it when another process has written a newer copy.
+    """
+    return _store.get()
+
+
+def persist():
+    """
+    Writes the graph to GRAPH_PATH atomically.
+    """
+    _store.persist()
+
+
+def backlinks(title):
+    """
+    Returns the titles of the entries linking to `title`.
+    """
+    return get_graph().backlinks(title)
+
+
+def broken_links():
+    """
+    Returns {missing title: [entries linking to it]}.
+    """
+    return get_graph().broken(util.list_entries())
+
+
+@receiver(entry_saved)
+def _update_on_save(sender, title, content, **kwargs):
+    graph = _store.loaded()
+    if graph is None:
+        # Not loaded yet; the stamp check on load will pick the change up
+        return
+    if graph.update(title, extract_markdown_links(content), util.entry_stamp(title)):
+        _store.schedule_persist()
+
+
+@receiver(entry_deleted)
+def _update_on_delete(sender, title, **kwargs):
+    graph = _store.loaded()
+    if graph is None:
+        return
+    graph.remove(title)
+    _store.schedule_persist()
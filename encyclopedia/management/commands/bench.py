@@ -0,0 +1,246 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from PIL import Image
+
+from encyclopedia import images, links, search, util
+
+WORDS = ["creación", "de", "projectos", "JPA", "análisis", "árbol", "búsqueda", "índice", "niño",
+         "programación", "lenguaje", "datos", "función", "módulo", "Django", "Python", "caché",
+         "señal", "diseño", "página", "rápido", "red", "núcleo", "sistema", "guía", "über"]
+CATEGORIES = ["Programation", "Framework Web", "Lenguaje de Programacion", "Bases de Datos", "Redes"]
+AUTHORS = ["Ana Torres", "Maria Lopez", "Grupo 6 - POO", "José Núñez", "Zoë Brontë"]
+
+
+def make_corpus(root, count, size, images_ratio=0.1, seed=0):
+    """
+    Writes `count` entries of about `size` bytes (log-normally spread) under
+    root/entries, their metadata in root/datas/wikis.json and small card
+    images for a fraction of them. Returns the list of titles.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    (root / "entries").mkdir(parents=True, exist_ok=True)
+    (root / "datas").mkdir(parents=True, exist_ok=True)
+    image_dir = root / images.IMAGE_DIR
+    image_dir.mkdir(parents=True, exist_ok=True)
+    titles, records = [], []
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize() + f" {i}"
+        titles.append(title)
+        target = max(64, int(rng.lognormvariate(0, 0.6) * size))
+        parts = [f"# {title}\n"]
+        while sum(map(len, parts)) < target:
+            kind = rng.random()
+            words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+            if kind < 0.15:
+                parts.append(f"\n## {words[:40]}\n")
+            elif kind < 0.3:
+                parts.append("".join(f"- {rng.choice(WORDS)} [{rng.choice(WORDS)}](/wiki/{rng.choice(titles)}/)\n"
+                                     for _ in range(rng.randint(2, 6))))
+            elif kind < 0.38:
+                parts.append(f"\n```python\ndef f(x):\n    return x * {i}\n```\n")
+            else:
+                parts.append(f"\n{words}. **{rng.choice(WORDS)}** y *{rng.choice(WORDS)}*.\n")
+        (root / "entries" / f"{title}.md").write_text("".join(parts), encoding="utf-8")
+        records.append({"title": title, "category": rng.choice(CATEGORIES), "author": rng.choice(AUTHORS)})
+        if rng.random() < images_ratio:
+            Image.new("RGB", (640, 400), tuple(rng.randrange(256) for _ in range(3))).save(
+                image_dir / f"{title}.webp", "WEBP")
+    (root / "datas" / "wikis.json").write_text(json.dumps(records, indent=2, ensure_ascii=False), encoding="utf-8")
+    return titles
+
+
+def measure(func, repeat):
+    """
+    Calls func() `repeat` times and returns timing statistics in milliseconds.
+    """
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "n": repeat,
+        "min": round(samples[0], 3),
+        "median": round(statistics.median(samples), 3),
+        "mean": round(statistics.fmean(samples), 3),
+        "p95": round(samples[min(repeat - 1, int(repeat * 0.95))], 3),
+        "max": round(samples[-1], 3),
+    }
+
+
+@contextlib.contextmanager
+def corpus_dir(root):
+    """
+    Makes `root` the working directory and MEDIA_ROOT, with the app's
+    process-wide caches pointed at it.
+    """
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        with override_settings(MEDIA_ROOT=str(root)):
+            images.registry.invalidate()
+            search._store.reset()
+            links._store.reset()
+            yield
+    finally:
+        os.chdir(cwd)
+        images.registry.invalidate()
+        # A pending write would land in the real datas/ directory
+        search._store.reset()
+        links._store.reset()
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the views, the hot util functions and the static build "
+            "against a synthetic corpus and writes the timings as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=1000, help="Corpus size for the request benchmarks")
+        parser.add_argument("--size", type=int, default=3000, help="Median entry size in bytes")
+        parser.add_argument("--repeat", type=int, default=50, help="Samples per benchmark")
+        parser.add_argument("--build-sizes", default="100,1000",
+                            help="Comma-separated corpus sizes for build_static (empty to skip)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="bench.json", help="Where to write the results")
+        parser.add_argument("--compare", help="Earlier results file to compare medians against")
+
+    def handle(self, *args, **options):
+        results = {
+            "meta": {
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "platform": platform.platform(),
+                "storage": getattr(settings, "WIKI_STORAGE_BACKEND", ""),
+                "options": {key: options[key] for key in ("entries", "size", "repeat", "build_sizes", "seed")},
+            },
+        }
+        tmp = Path(tempfile.mkdtemp(prefix="wiki-bench-"))
+        try:
+            root = tmp / "app"
+            started = time.perf_counter()
+            titles = make_corpus(root, options["entries"], options["size"], seed=options["seed"])
+            results["corpus"] = {"entries": len(titles), "seconds": round(time.perf_counter() - started, 3)}
+            with corpus_dir(root):
+                results["requests"] = self.bench_requests(titles, options["repeat"], options["seed"])
+                results["micro"] = self.bench_micro(titles, options["repeat"], options["seed"])
+            sizes = [int(size) for size in options["build_sizes"].split(",") if size.strip()]
+            results["build"] = {str(size): self.bench_build(tmp / f"build-{size}", size, options)
+                                for size in sizes}
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        self.report(results, options["compare"])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def bench_requests(self, titles, repeat, seed):
+        rng = random.Random(seed)
+        client = Client()
+        queries = [rng.choice(WORDS) for _ in range(repeat)] + ["progrmacion", "Creacion de proj"]
+
+        def get(url, status=200):
+            response = client.get(url)
+            if response.status_code != status:
+                raise AssertionError(f"GET {url}: {response.status_code}")
+            if response.streaming:
+                b"".join(response.streaming_content)
+
+        def newpage(i):
+            response = client.post("/newpage/", {"title": f"Bench página {seed}-{i}", "category": "Bench",
+                                                 "author": "bench", "content": "# Bench\n\nnuevo **texto**"})
+            if response.status_code != 200:
+                raise AssertionError(f"POST /newpage/: {response.status_code}")
+
+        setup_test_environment()
+        try:
+            # First requests load the search index and the metadata
+            get("/search/?q=warmup")
+            return {
+                "index": measure(lambda i: get("/"), repeat),
+                "index_all": measure(lambda i: get("/all/"), max(1, repeat // 10)),
+                "wiki": measure(lambda i: get(f"/wiki/{rng.choice(titles)}/"), repeat),
+                "wiki_cached": measure(lambda i: get(f"/wiki/{titles[0]}/"), repeat),
+                "search": measure(lambda i: get(f"/search/?q={queries[i % len(queries)]}"), repeat),
+                "randpage": measure(lambda i: get("/randpage/", 302), repeat),
+                "newpage": measure(newpage, repeat),
+            }
+        finally:
+            teardown_test_environment()
+
+    def bench_micro(self, titles, repeat, seed):
+        rng = random.Random(seed)
+        contents = [util.get_entry(title) for title in rng.sample(titles, min(len(titles), repeat))]
+        page = titles[:settings.WIKI_INDEX_PAGE_SIZE]
+        return {
+            "match_substring": measure(lambda i: util.match(titles, rng.choice(WORDS)), repeat),
+            "match_fuzzy": measure(lambda i: util.match(titles, "progrmacion datso", umb=0.6), repeat),
+            "get_entries_meta_page": measure(lambda i: util.get_entries_meta(page), repeat),
+            "get_entries_meta_all": measure(lambda i: util.get_entries_meta(titles), max(1, repeat // 10)),
+            "render_markdown": measure(lambda i: util.render_markdown(contents[i % len(contents)]), repeat),
+            "render_markdown_many": measure(lambda i: util.render_markdown_many(contents[:10]), max(1, repeat // 10)),
+        }
+
+    def bench_build(self, root, size, options):
+        import build_static
+
+        make_corpus(root, size, options["size"], seed=options["seed"])
+        public = root / "public"
+        repo = Path(settings.BASE_DIR)
+        paths = {
+            "ENTRIES": root / "entries",
+            "DATAS": root / "datas" / "wikis.json",
+            "DATAS_JOURNAL": root / "datas" / "wikis.log",
+            "PUBLIC": public,
+            "MANIFEST": public / ".build-manifest.json",
+            "STATIC_SRC": [repo / "static", repo / "encyclopedia" / "static"],
+            "IMAGES": images.ImageRegistry(root / images.IMAGE_DIR),
+        }
+        timings = {}
+        with mock.patch.multiple(build_static, **paths), contextlib.redirect_stdout(io.StringIO()):
+            for name, argv in (("full", ["--full"]), ("noop", []), ("incremental", []),
+                               ("full_parallel", ["--full", "--jobs", "0"])):
+                if name == "incremental":
+                    # One edited entry
+                    edited = next(paths["ENTRIES"].glob("*.md"))
+                    edited.write_text(edited.read_text(encoding="utf-8") + "\nEditado.\n", encoding="utf-8")
+                start = time.perf_counter()
+                build_static.main(argv)
+                timings[name] = round(time.perf_counter() - start, 3)
+        return timings
+
+    def report(self, results, compare):
+        previous = {}
+        if compare:
+            with open(compare, encoding="utf-8") as f:
+                previous = json.load(f)
+        for group in ("requests", "micro"):
+            self.stdout.write(f"{group}:")
+            for name, stats in results[group].items():
+                line = f"  {name:<24} median {stats['median']:>9.3f} ms   p95 {stats['p95']:>9.3f} ms"
+                before = previous.get(group, {}).get(name)
+                if before and before["median"]:
+                    line += f"   x{stats['median'] / before['median']:.2f} vs {compare}"
+                self.stdout.write(line)
+        for size, timings in results.get("build", {}).items():
+            self.stdout.write(f"build {size} entries: " + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items()))
@@ -0,0 +1,304 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from encyclopedia import images, util
+from encyclopedia.storage import meta_key
+
+# Same limit as the "title" field of forms.NewWiki
+MAX_TITLE = 100
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Tar members up to this size are kept in memory while importing; larger
+# ones (mostly images) are unpacked to a temporary directory
+SPOOL_MAX = 256 * 1024
+
+
+@contextmanager
+def open_source(path):
+    """
+    Yields {relative posix name: read()} for the files in a directory, a
+    tar archive or a zip archive. Reads happen on demand, while open.
+    """
+    path = Path(path)
+    if path.is_dir():
+        yield {file.relative_to(path).as_posix(): file.read_bytes
+               for file in sorted(path.rglob("*")) if file.is_file()}
+    elif path.name.endswith(TAR_SUFFIXES):
+        # A compressed tar can only be read front to back (each backward seek
+        # decompresses from the start again), while the import reads in title
+        # order: unpack it in one sequential pass, large files to a temporary
+        # directory and the rest in memory
+        with tempfile.TemporaryDirectory(prefix="bulk_entries.") as tmp, \
+                tarfile.open(path, "r:*") as archive:
+            members = {}
+            for number, member in enumerate(archive):
+                if not member.isfile():
+                    continue
+                with archive.extractfile(member) as source:
+                    if member.size <= SPOOL_MAX:
+                        members[member.name] = lambda data=source.read(): data
+                        continue
+                    # Numbered files: member names are only trusted by classify()
+                    target = Path(tmp, str(number))
+                    with open(target, "wb") as f:
+                        shutil.copyfileobj(source, f)
+                members[member.name] = target.read_bytes
+            yield members
+    elif path.suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            yield {info.filename: (lambda name=info.filename: archive.read(name))
+                   for info in archive.infolist() if not info.is_dir()}
+    else:
+        raise CommandError(f"{path}: not a directory, tar or zip archive")
+
+
+def classify(members):
+    """
+    Sorts archive members into entries/<title>.md, wikis.json and
+    images/<title>.<ext>; other files (and unsafe paths) are ignored.
+    """
+    entries, meta_files, image_files, ignored = {}, [], {}, []
+    for name, read in members.items():
+        parts = PurePosixPath(name).parts
+        if not parts or name.startswith("/") or ".." in parts:
+            ignored.append(name)
+            continue
+        filename = PurePosixPath(name)
+        parent = parts[-2] if len(parts) > 1 else ""
+        if filename.name == "wikis.json":
+            meta_files.append((name, read))
+        elif filename.suffix == ".md" and parent in ("entries", ""):
+            entries[filename.stem] = read
+        elif parent == "images" and filename.suffix.lower() in images.SOURCE_EXTENSIONS:
+            image_files[filename.stem] = (filename.suffix.lower(), read)
+        else:
+            ignored.append(name)
+    return entries, meta_files, image_files, ignored
+
+
+def title_error(title):
+    if not title.strip():
+        return "empty title"
+    if len(title) > MAX_TITLE:
+        return f"title longer than {MAX_TITLE} characters"
+    if title != title.strip() or title.startswith("."):
+        return "title has leading/trailing spaces or starts with a dot"
+    if any(ch in title for ch in '/\\:*?"<>|') or any(ord(ch) < 32 for ch in title):
+        return "title contains characters not allowed in file names"
+    return None
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = ("Bulk-imports entries, metadata and images from a directory or a "
+            "tar/zip archive (entries/<title>.md, wikis.json, images/<title>.<ext>), "
+            "or exports them in the same layout.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["import", "export"])
+        parser.add_argument("path", help="Directory, .zip or .tar[.gz|.bz2|.xz]")
+        parser.add_argument("--batch-size", type=int, default=500, help="Entries per metadata write")
+        parser.add_argument("--jobs", "-j", type=int, default=0,
+                            help="Threads converting images (0 = one per CPU)")
+        parser.add_argument("--overwrite", action="store_true",
+                            help="Replace entries that already exist instead of rejecting them")
+        parser.add_argument("--skip-invalid", action="store_true",
+                            help="Import the valid entries even if others fail validation")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate")
+
+    def handle(self, *args, **options):
+        if options["action"] == "export":
+            self.export(Path(options["path"]))
+        else:
+            self.import_(Path(options["path"]), options)
+
+    # Import
+
+    def import_(self, path, options):
+        started = time.perf_counter()
+        with open_source(path) as members:
+            entries, meta_files, image_files, ignored = classify(members)
+            records, errors = self.validate(entries, meta_files, image_files, options["overwrite"])
+            for title, error in sorted(errors.items()):
+                self.stderr.write(f"{title}: {error}")
+            if errors and not options["skip_invalid"]:
+                raise CommandError(f"{len(errors)} invalid entries, nothing imported (see --skip-invalid)")
+            titles = sorted(title for title in entries if title not in errors)
+            self.stdout.write(f"{len(titles)} entries valid, {len(errors)} invalid, "
+                              f"{len(ignored)} files ignored ({time.perf_counter() - started:.1f}s)")
+            if options["dry_run"] or not titles:
+                return
+
+            jobs = options["jobs"] or os.cpu_count() or 1
+            done = total_bytes = image_count = 0
+            with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="import") as pool:
+                for batch in chunks(titles, max(1, options["batch_size"])):
+                    batch_bytes, variants = self.write_images(batch, image_files, pool)
+                    contents = {title: entries[title]() for title in batch}
+                    with transaction.atomic():
+                        for title in batch:
+                            util.save_entry(title, contents[title].decode("utf-8-sig"))
+                        new_records, updates = [], []
+                        for title in batch:
+                            record = dict(records[title], title=title)
+                            if title in variants:
+                                record["images"] = variants[title]
+                            (updates if util.get_meta(title) else new_records).append(record)
+                        # One metadata write for the whole batch
+                        util.save_data_many(new_records)
+                        for record in updates:
+                            util.update_data(record["title"], **{k: v for k, v in record.items() if k != "title"})
+                    done += len(batch)
+                    image_count += len(variants)
+                    total_bytes += batch_bytes + sum(len(content) for content in contents.values())
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"  {done}/{len(titles)} entries, {image_count} images "
+                                      f"({done / elapsed:.0f} entries/s, {total_bytes / elapsed / 1e6:.1f} MB/s)")
+            # Fold the batches' journaled metadata writes into wikis.json at once
+            util.get_backend().compact()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {done} entries and {image_count} images in {elapsed:.1f}s "
+            f"({done / elapsed:.0f} entries/s)."))
+
+    def validate(self, entries, meta_files, image_files, overwrite):
+        """
+        Returns ({title: metadata fields}, {title: error}).
+        """
+        errors = {}
+        by_key = {}
+        for name, read in meta_files:
+            try:
+                data = json.loads(read().decode("utf-8-sig"))
+            except (UnicodeDecodeError, ValueError) as exc:
+                raise CommandError(f"{name}: invalid JSON ({exc})")
+            if not isinstance(data, list):
+                raise CommandError(f"{name}: expected a list of records")
+            for record in data:
+                if isinstance(record, dict) and isinstance(record.get("title"), str):
+                    by_key.setdefault(meta_key(record["title"]), record)
+
+        records, seen = {}, {}
+        existing = {meta_key(title) for title in util.list_entries()}
+        for title, read in entries.items():
+            key = meta_key(title)
+            error = title_error(title)
+            if error is None and key in seen:
+                error = f"same title as '{seen[key]}' (case-insensitive)"
+            if error is None and not overwrite and (key in existing or util.get_meta(title)):
+                error = "already exists (use --overwrite)"
+            record = by_key.get(key)
+            if error is None and record is None:
+                error = "no record in wikis.json"
+            if error is None:
+                fields = {k: v for k, v in record.items() if k != "title"}
+                for field in ("category", "author"):
+                    if not isinstance(fields.get(field), str) or not fields[field].strip():
+                        error = f"missing {field}"
+                    elif len(fields[field]) > MAX_TITLE:
+                        error = f"{field} longer than {MAX_TITLE} characters"
+            if error is None:
+                try:
+                    read().decode("utf-8-sig")
+                except UnicodeDecodeError:
+                    error = "content is not UTF-8"
+            if error is None and title in image_files:
+                try:
+                    with Image.open(io.BytesIO(image_files[title][1]())) as img:
+                        img.verify()
+                except Exception as exc:
+                    error = f"unreadable image ({exc})"
+            seen[key] = title
+            if error:
+                errors[title] = error
+            else:
+                records[title] = fields
+        return records, errors
+
+    def write_images(self, batch, image_files, pool):
+        """
+        Writes the batch's images, then converts them to WEBP and renders the
+        card variants on the pool. Returns (bytes written, {title: variants}).
+        """
+        os.makedirs(images.IMAGE_DIR, exist_ok=True)
+        written = 0
+        titles = [title for title in batch if title in image_files]
+        for title in titles:
+            ext, read = image_files[title]
+            # Drop older uploads in other formats; the registry prefers .webp
+            for old_ext in images.SOURCE_EXTENSIONS:
+                old = os.path.join(images.IMAGE_DIR, f"{title}{old_ext}")
+                if os.path.exists(old):
+                    os.remove(old)
+            data = read()
+            with open(os.path.join(images.IMAGE_DIR, f"{title}{ext}"), "wb") as f:
+                f.write(data)
+            written += len(data)
+
+        def convert(title):
+            source = util.convert_to_webp(title) or os.path.join(images.IMAGE_DIR, f"{title}{image_files[title][0]}")
+            return title, images.generate_variants(title, source)
+
+        variants = {title: result for title, result in pool.map(convert, titles) if result}
+        images.registry.invalidate()
+        return written, variants
+
+    # Export
+
+    def export(self, path):
+        started = time.perf_counter()
+        titles = util.list_entries()
+        records = {meta_key(record["title"]): record for record in util.get_backend().all_meta()}
+        registry = images.registry.refresh()
+        meta = [records[meta_key(title)] for title in titles if meta_key(title) in records]
+        with self.archive_writer(path) as write:
+            write("wikis.json", json.dumps(meta, indent=2, ensure_ascii=False).encode("utf-8"))
+            for done, title in enumerate(titles, 1):
+                content = util.get_entry(title)
+                if content is not None:
+                    write(f"entries/{title}.md", content.encode("utf-8"))
+                source = registry.source(title)
+                if source:
+                    with open(source, "rb") as f:
+                        write(f"images/{title}{os.path.splitext(source)[1]}", f.read())
+                if done % 500 == 0:
+                    self.stdout.write(f"  {done}/{len(titles)} entries")
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(titles)} entries to {path} in {time.perf_counter() - started:.1f}s."))
+
+    @contextmanager
+    def archive_writer(self, path):
+        if path.name.endswith(TAR_SUFFIXES):
+            mode = {".gz": "w:gz", ".tgz": "w:gz", ".bz2": "w:bz2", ".xz": "w:xz"}.get(path.suffix, "w")
+            with tarfile.open(path, mode) as archive:
+                def write(name, data):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mtime = int(time.time())
+                    archive.addfile(info, io.BytesIO(data))
+                yield write
+        elif path.suffix == ".zip":
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                yield archive.writestr
+        else:
+            def write(name, data):
+                target = path / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_bytes(data)
+            yield write
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from encyclopedia import images, util
+
+
+class Command(BaseCommand):
+    help = "Generates the resized card image variants for existing entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("titles", nargs="*", help="Entries to process (default: all)")
+
+    def handle(self, *args, **options):
+        titles = options["titles"] or util.list_entries()
+        futures = [(title, images.schedule_variants(title)) for title in titles]
+        for title, future in futures:
+            variants = future.result()
+            if variants:
+                self.stdout.write(f"{title}: {sum(len(urls) for urls in variants.values())} variants")
+            else:
+                self.stdout.write(f"{title}: no image")
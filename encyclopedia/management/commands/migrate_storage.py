@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from encyclopedia.storage import DatabaseBackend, FilesystemBackend
+
+
+class Command(BaseCommand):
+    help = ("Imports entries/*.md and datas/wikis.json into the database store "
+            "used by encyclopedia.storage.DatabaseBackend. Safe to re-run: "
+            "existing entries are overwritten, existing metadata is kept.")
+
+    def handle(self, *args, **options):
+        source = FilesystemBackend()
+        target = DatabaseBackend()
+        titles = source.list_entries()
+        records = source.all_meta()
+        added = 0
+        with transaction.atomic():
+            for title in titles:
+                target.save_entry(title, source.get_entry(title))
+            for record in records:
+                if target.add_meta(record):
+                    added += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(titles)} entries and {added} new metadata records "
+            f"({len(records) - added} already present)."))
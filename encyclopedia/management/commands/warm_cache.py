@@ -0,0 +1,61 @@
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import links, search, util, warmup
+
+
+class Command(BaseCommand):
+    help = ("Warms the caches: brings the search index and link graph files up to date, "
+            "and with --url requests every entry page from a running server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("titles", nargs="*", help="Entries to request with --url (default: all)")
+        parser.add_argument("--limit", type=int, default=0,
+                            help="Request at most this many entries (0 = all)")
+        parser.add_argument("--url", help="Base URL of a running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument("--jobs", "-j", type=int, default=4, help="Concurrent requests with --url")
+
+    def handle(self, *args, **options):
+        if options["url"]:
+            titles = options["titles"] or util.list_entries()
+            if options["limit"]:
+                titles = titles[:options["limit"]]
+            self.warm_server(options["url"].rstrip("/"), titles, max(1, options["jobs"]))
+            return
+        # Rendering here would only fill this process's cache, gone on exit;
+        # the index files are what the server processes share
+        started = time.perf_counter()
+        warmup.load_indexes()
+        # The indexes are written after a short delay; don't exit before that
+        search.persist()
+        links.persist()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote the search index and the link graph in {time.perf_counter() - started:.1f}s."))
+
+    def warm_server(self, base, titles, jobs):
+        started = time.perf_counter()
+
+        def fetch(title):
+            try:
+                with urllib.request.urlopen(f"{base}/wiki/{quote(title, safe='')}/", timeout=60) as response:
+                    response.read()
+                return title, None
+            except (urllib.error.URLError, OSError) as exc:
+                return title, exc
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for title, error in pool.map(fetch, titles):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{title}: {error}")
+        if failed == len(titles) and titles:
+            raise CommandError(f"could not reach {base}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Requested {len(titles) - failed} pages in {time.perf_counter() - started:.1f}s "
+            f"({failed} failed)."))
@@ -1,3 +1,42 @@
 from django.db import models
 
-# Create your models here.
+from .storage import meta_key
+
+# Models used by storage.DatabaseBackend (WIKI_STORAGE_BACKEND).
+
+
+class Entry(models.Model):
+    title = models.CharField(max_length=255, unique=True)
+    content = models.TextField()
+    # Size in bytes of the UTF-8 content; with `updated` it forms the entry stamp
+    size = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+
+class EntryMeta(models.Model):
+    title = models.CharField(max_length=255)
+    # Casefolded title: the title index and the duplicate check
+    title_key = models.CharField(max_length=255, unique=True)
+    category = models.CharField(max_length=100, blank=True)
+    author = models.CharField(max_length=100, blank=True)
+    # Any other metadata fields (e.g. image variants)
+    extra = models.JSONField(default=dict, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+    def as_record(self):
+        """
+        Returns the metadata as the dict stored in datas/wikis.json.
+        """
+        return {"title": self.title, "category": self.category, "author": self.author, **self.extra}
+
+    @classmethod
+    def from_record(cls, record):
+        extra = {key: value for key, value in record.items() if key not in ("title", "category", "author")}
+        return cls(title=record["title"], title_key=meta_key(record["title"]),
+                   category=record.get("category") or "", author=record.get("author") or "", extra=extra)
@@ -0,0 +1,116 @@
+"""
+Process-wide in-memory indexes persisted as JSON, shared by the search
+index and the link graph.
+
+An index class provides dump(), from_dump(data) and sync(), the latter
+bringing it up to date with the stored entries and returning True if
+anything changed. PersistedIndex loads it lazily from its JSON file,
+writes it back atomically a few seconds after a burst of updates, and
+reloads it when another process has written a newer copy.
+"""
+import json
+import os
+import threading
+
+from django.core.files.storage import default_storage
+
+from .storage import _stamp
+
+# Seconds to wait after an update before writing the index back to disk
+PERSIST_DELAY = 2.0
+
+
+class PersistedIndex:
+    """
+    Lazily loaded, debounced-persisted instance of `index_class` stored at
+    `path` (relative to default_storage).
+    """
+
+    def __init__(self, path, index_class):
+        self.path = path
+        self.index_class = index_class
+        # "stamp" is the version of the file the in-memory index matches
+        self.state = {"index": None, "stamp": None, "timer": None}
+        self.lock = threading.Lock()
+
+    def _file_stamp(self):
+        return _stamp(default_storage.path(self.path))
+
+    def _load(self):
+        data = {}
+        if default_storage.exists(self.path):
+            try:
+                with default_storage.open(self.path, "rb") as f:
+                    data = json.loads(f.read().decode("utf-8"))
+            except Exception:
+                data = {}
+        index = self.index_class.from_dump(data)
+        if index.sync():
+            self.schedule_persist()
+        return index
+
+    def get(self):
+        """
+        Returns the index, loading it on first use and reloading it when
+        another process has written a newer copy.
+        """
+        with self.lock:
+            index = self.state["index"]
+            # With a write pending, the in-memory index is the newer one
+            stale = index is not None and self.state["timer"] is None and self._file_stamp() != self.state["stamp"]
+            if index is not None and not stale:
+                return index
+            self.state["index"] = None
+        index = self._load()
+        with self.lock:
+            if self.state["index"] is None:
+                self.state["index"] = index
+                if self.state["timer"] is None:
+                    self.state["stamp"] = self._file_stamp()
+            return self.state["index"]
+
+    def loaded(self):
+        """
+        Returns the index if it is loaded, else None (receivers skip the
+        update then: the stamp check on load picks the change up).
+        """
+        with self.lock:
+            return self.state["index"]
+
+    def persist(self):
+        """
+        Writes the index to its file atomically.
+        """
+        with self.lock:
+            index = self.state["index"]
+            self.state["timer"] = None
+        if index is None:
+            return
+        content = json.dumps(index.dump(), ensure_ascii=False, separators=(",", ":"))
+        path = default_storage.path(self.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.state["stamp"] = self._file_stamp()
+
+    def schedule_persist(self):
+        # Coalesce bursts of updates into one write
+        with self.lock:
+            if self.state["timer"] is not None:
+                return
+            timer = threading.Timer(PERSIST_DELAY, self.persist)
+            timer.daemon = True
+            self.state["timer"] = timer
+        timer.start()
+
+    def reset(self):
+        """
+        Forgets the loaded index, cancelling any pending write.
+        """
+        with self.lock:
+            if self.state["timer"] is not None:
+                self.state["timer"].cancel()
+            self.state.update(index=None, stamp=None, timer=None)
@@ -0,0 +1,152 @@
+"""
+Markdown -> sanitized HTML rendering, shared by the views and build_static.
+
+Building a markdown.Markdown instance loads and registers every extension,
+and bleach.clean() builds a new Cleaner (and its html5lib parser setup) on
+each call. Both are built once per thread here and reset between
+documents. Neither is thread-safe, hence one pair per thread.
+
+split_sections() cuts long entries at their h1/h2 headings so that they can
+be rendered, cached and served one section at a time.
+
+This module has no Django dependencies so the static builder can use it in
+its worker processes. Stage timings go through a `stage(name)` context
+manager factory: instrumentation.stage in the app, `collect(totals)` in
+the builder.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import markdown
+from bleach.sanitizer import Cleaner
+
+EXTENSIONS = ["extra", "fenced_code"]
+
+# Bleach policy: allow class attribute so users can use CSS classes defined in site CSS
+ALLOWED_TAGS = [
+    'p','br','ul','ol','li','strong','em','a','img','h1','h2','h3','pre','code','blockquote',
+    # table-related tags
+    'table','thead','tbody','tr','th','td'
+]
+ALLOWED_ATTRS = {
+    'a': ['href', 'title', 'rel'],
+    'img': ['src', 'alt', 'title'],
+    # allow certain table attributes that are commonly used
+    'th': ['colspan', 'rowspan', 'scope', 'class'],
+    'td': ['colspan', 'rowspan', 'class'],
+    '*': ['class']
+}
+
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_SECTION_HEADING_RE = re.compile(r"^ {0,3}(#{1,2})(?!#)(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+# Reference links, footnotes and abbreviations apply to the whole document
+_DEFINITION_RE = re.compile(r"^ {0,3}\*?\[[^\]]+\]:", re.MULTILINE)
+_INLINE_LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+
+_local = threading.local()
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+def _engines():
+    """
+    Returns this thread's (Markdown, Cleaner) pair, creating it on first use.
+    """
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = (
+            markdown.Markdown(extensions=EXTENSIONS),
+            Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True),
+        )
+    return engines
+
+
+def to_html(content, stage=_no_stage):
+    """
+    Converts Markdown to HTML without sanitizing it.
+    """
+    md, _ = _engines()
+    with stage("markdown"):
+        # reset() drops the state left by the previous document (footnotes, abbreviations...)
+        return md.reset().convert(content)
+
+
+def sanitize(html, stage=_no_stage):
+    _, cleaner = _engines()
+    with stage("bleach"):
+        return cleaner.clean(html)
+
+
+def render(content, stage=_no_stage):
+    """
+    Converts Markdown content to sanitized HTML.
+    """
+    return sanitize(to_html(content, stage), stage)
+
+
+def render_many(contents, stage=_no_stage):
+    """
+    Renders several documents with the same instances. Each stage is timed
+    once for the whole batch. Returns the HTML in the same order.
+    """
+    md, cleaner = _engines()
+    with stage("markdown"):
+        pages = [md.reset().convert(content) for content in contents]
+    with stage("bleach"):
+        return [cleaner.clean(page) for page in pages]
+
+
+def split_sections(content):
+    """
+    Splits Markdown at its h1/h2 (ATX) headings, ignoring those inside fenced
+    code. Returns [(level, heading text, source)], where text before the
+    first heading is a level 0 section without heading, or None when the
+    sections could not be rendered separately (reference-style links,
+    footnotes or abbreviations defined in one part and used in another).
+    """
+    if _DEFINITION_RE.search(content):
+        return None
+    sections = [[0, None, []]]
+    fence = None
+    for line in content.splitlines(keepends=True):
+        match = _FENCE_RE.match(line)
+        if fence is None and match:
+            fence = match.group(1)
+        elif fence is not None:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) \
+                    and not line.strip()[len(match.group(1)):]:
+                fence = None
+        else:
+            match = _SECTION_HEADING_RE.match(line.rstrip("\r\n"))
+            if match:
+                sections.append([len(match.group(1)), heading_text(match.group(2) or ""), []])
+        sections[-1][2].append(line)
+    if not "".join(sections[0][2]).strip():
+        sections.pop(0)
+    return [(level, heading, "".join(lines)) for level, heading, lines in sections]
+
+
+def heading_text(source):
+    """
+    Plain text of a Markdown heading, for tables of contents.
+    """
+    text = _INLINE_LINK_RE.sub(r"\1", source)
+    return re.sub(r"[*_`]", "", text).strip()
+
+
+def collect(totals):
+    """
+    Returns a stage() that adds each stage's seconds to totals[name].
+    """
+    @contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+    return stage
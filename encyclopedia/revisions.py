@@ -0,0 +1,227 @@
+"""
+Revision history of the entries.
+
+Every saved version of an entry is appended to datas/revisions/<title>.rev
+(under default_storage, whatever the storage backend). A record is a small
+header plus a zlib-compressed payload, which is either a full snapshot of
+the content or a delta against the previous revision: the difflib line
+opcodes, as ranges copied from the previous version plus the inserted text.
+Deltas cost about the size of the change, and a snapshot is written every
+WIKI_REVISION_SNAPSHOT_EVERY revisions (or when a delta would not be
+smaller), so rebuilding any revision replays a bounded number of deltas,
+all read with a single read.
+
+Files are only ever appended to, so the per-process index of record
+offsets catches up by reading just the new headers, as the metadata
+journal does. Deleting an entry keeps its history.
+"""
+import difflib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .storage import _file_lock, _stamp
+
+REVISIONS_DIR = "datas/revisions"
+# kind (0 snapshot, 1 delta), UNIX time, content size in bytes, payload size
+HEADER = struct.Struct("<BdII")
+SNAPSHOT, DELTA = 0, 1
+
+Revision = namedtuple("Revision", "number offset snapshot timestamp size length")
+
+# Revision file path -> {"stamp", "offset", "revisions"}
+_indexes = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, "WIKI_REVISIONS", False)
+
+
+def snapshot_every():
+    return max(1, getattr(settings, "WIKI_REVISION_SNAPSHOT_EVERY", 16))
+
+
+def _path(title):
+    return default_storage.path(f"{REVISIONS_DIR}/{title}.rev")
+
+
+def encode_delta(base, content):
+    """
+    Returns the delta turning `base` into `content`: a JSON list of [start,
+    end] line ranges copied from base and strings inserted in between.
+    """
+    old = base.splitlines(keepends=True)
+    new = content.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(new[j1:j2]))
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(base, delta):
+    old = base.splitlines(keepends=True)
+    return "".join("".join(old[op[0]:op[1]]) if isinstance(op, list) else op
+                   for op in json.loads(delta))
+
+
+def _scan(path, offset, first_number):
+    """
+    Returns (revisions, offset after the last complete record) for the
+    records from `offset` on. A record still being written (or left
+    incomplete by a crash) is left for later.
+    """
+    found = []
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        while offset + HEADER.size <= end:
+            kind, timestamp, size, length = HEADER.unpack(f.read(HEADER.size))
+            if kind not in (SNAPSHOT, DELTA) or offset + HEADER.size + length > end:
+                break
+            found.append(Revision(first_number + len(found), offset, kind == SNAPSHOT, timestamp, size, length))
+            offset += HEADER.size + length
+            f.seek(offset)
+    return found, offset
+
+
+def _index(path):
+    """
+    Returns the up-to-date index of a revision file. Must be called with _lock held.
+    """
+    stamp = _stamp(path)
+    index = _indexes.get(path)
+    if stamp is None:
+        _indexes.pop(path, None)
+        return {"stamp": None, "offset": 0, "revisions": []}
+    if index is None or stamp[1] < index["offset"]:
+        # New, or replaced by a shorter file: read it from the start
+        index = _indexes[path] = {"stamp": None, "offset": 0, "revisions": []}
+    if index["stamp"] != stamp:
+        found, offset = _scan(path, index["offset"], len(index["revisions"]) + 1)
+        index["revisions"].extend(found)
+        index["offset"] = offset
+        index["stamp"] = stamp
+    return index
+
+
+def _rebuild(path, revisions, number):
+    """
+    Rebuilds revision `number` from the closest snapshot before it.
+    """
+    target = revisions[number - 1]
+    start = target
+    while not start.snapshot:
+        start = revisions[start.number - 2]
+    with open(path, "rb") as f:
+        f.seek(start.offset)
+        data = f.read(target.offset + HEADER.size + target.length - start.offset)
+    content = None
+    for revision in revisions[start.number - 1:number]:
+        at = revision.offset - start.offset + HEADER.size
+        payload = zlib.decompress(data[at:at + revision.length]).decode("utf-8")
+        content = payload if revision.snapshot else apply_delta(content, payload)
+    return content
+
+
+def count(title):
+    """
+    Returns the number of revisions stored for an entry.
+    """
+    with _lock:
+        return len(_index(_path(title))["revisions"])
+
+
+def history(title):
+    """
+    Returns the revisions of an entry, oldest first, as dicts with number,
+    date, size (bytes) and snapshot.
+    """
+    with _lock:
+        revisions = list(_index(_path(title))["revisions"])
+    return [{"number": revision.number, "size": revision.size, "snapshot": revision.snapshot,
+             "date": datetime.fromtimestamp(revision.timestamp, tz=timezone.utc)}
+            for revision in revisions]
+
+
+def get(title, number):
+    """
+    Returns the content of revision `number` (1 is the oldest), or None.
+    """
+    path = _path(title)
+    with _lock:
+        revisions = _index(path)["revisions"]
+        if not 1 <= number <= len(revisions):
+            return None
+    try:
+        return _rebuild(path, revisions, number)
+    except (FileNotFoundError, zlib.error, UnicodeDecodeError, ValueError):
+        # Gone, or a damaged record
+        return None
+
+
+def record(title, content, timestamp=None):
+    """
+    Appends `content` as a new revision of an entry, unless it is the same
+    as the latest one. Returns the new revision number, or None.
+    """
+    path = _path(title)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raw = content.encode("utf-8")
+    # The file lock keeps appends from several processes whole and in order
+    with _lock, _file_lock(path):
+        index = _index(path)
+        revisions = index["revisions"]
+        try:
+            latest = _rebuild(path, revisions, len(revisions)) if revisions else None
+        except (zlib.error, UnicodeDecodeError, ValueError):
+            # Damaged: start again from a snapshot
+            latest = None
+        if latest == content:
+            return None
+        kind, payload = SNAPSHOT, raw
+        since_snapshot = next((i for i, revision in enumerate(reversed(revisions)) if revision.snapshot),
+                              len(revisions))
+        if latest is not None and since_snapshot + 1 < snapshot_every():
+            delta = encode_delta(latest, content).encode("utf-8")
+            # A rewrite is cheaper stored whole
+            if len(delta) < len(raw):
+                kind, payload = DELTA, delta
+        payload = zlib.compress(payload)
+        header = HEADER.pack(kind, timestamp or time.time(), len(raw), len(payload))
+        with open(path, "ab") as f:
+            # Past the last complete record is only what a crashed write left
+            if os.fstat(f.fileno()).st_size > index["offset"]:
+                f.truncate(index["offset"])
+            offset = f.seek(0, os.SEEK_END)
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        revisions.append(Revision(len(revisions) + 1, offset, kind == SNAPSHOT,
+                                  HEADER.unpack(header)[1], len(raw), len(payload)))
+        index.update(offset=offset + len(header) + len(payload), stamp=_stamp(path))
+        _indexes[path] = index
+        return len(revisions)
+
+
+def diff(title, old, new, context=3):
+    """
+    Returns the unified diff lines between two revisions, or None if either
+    does not exist.
+    """
+    before, after = get(title, old), get(title, new)
+    if before is None or after is None:
+        return None
+    return list(difflib.unified_diff(before.splitlines(), after.splitlines(),
+                                     f"{title} r{old}", f"{title} r{new}", n=context, lineterm=""))
@@ -0,0 +1,197 @@
+"""
+Full-text search over encyclopedia entries.
+
+Titles and Markdown bodies are tokenized into accent-insensitive terms and
+kept in an inverted index ranked with BM25. The index is persisted to
+datas/search_index.json, together with the (mtime, size) stamp each entry
+was indexed at, so a restart only re-reads entries that changed on disk.
+"""
+import heapq
+import math
+import threading
+from collections import Counter
+
+from django.dispatch import receiver
+
+from . import util
+from .instrumentation import timed
+from .persisted import PersistedIndex
+from .signals import entry_deleted, entry_saved
+from .text import tokenize
+
+INDEX_PATH = "datas/search_index.json"
+INDEX_FORMAT = 1
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# A term in the title counts as this many occurrences in the body
+TITLE_WEIGHT = 5
+
+def _term_counts(title, content):
+    counts = Counter(tokenize(content))
+    for term in tokenize(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+class SearchIndex:
+    """
+    Inverted index of term -> {title: weighted term frequency}.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        # title -> (stamp, {term: tf}); the forward index makes removal cheap
+        self.docs = {}
+        self.lengths = {}
+        self.total_length = 0
+        # title -> BM25 length normalization, rebuilt lazily after changes
+        self.norms = None
+        self.lock = threading.Lock()
+
+    def add(self, title, content, stamp=None):
+        counts = _term_counts(title, content)
+        with self.lock:
+            self._remove(title)
+            self._insert(title, stamp, counts)
+
+    def remove(self, title):
+        with self.lock:
+            self._remove(title)
+
+    def _insert(self, title, stamp, counts):
+        self.docs[title] = (stamp, counts)
+        self.lengths[title] = sum(counts.values())
+        self.total_length += self.lengths[title]
+        self.norms = None
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[title] = tf
+
+    def _remove(self, title):
+        doc = self.docs.pop(title, None)
+        if doc is None:
+            return
+        _, counts = doc
+        self.total_length -= self.lengths.pop(title)
+        self.norms = None
+        for term in counts:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(title, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query, limit=None):
+        """
+        Returns titles matching any query term, best BM25 score first.
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            n_docs = len(self.docs)
+            if not terms or not n_docs:
+                return []
+            norms = self._norms()
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                weight = math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) * (K1 + 1)
+                for title, tf in posting.items():
+                    scores[title] = scores.get(title, 0.0) + weight * tf / (tf + norms[title])
+        key = lambda title: (-scores[title], title)
+        if limit:
+            return heapq.nsmallest(limit, scores, key=key)
+        return sorted(scores, key=key)
+
+    def _norms(self):
+        if self.norms is None:
+            avg_length = self.total_length / len(self.docs)
+            self.norms = {title: K1 * (1 - B + B * length / avg_length)
+                          for title, length in self.lengths.items()}
+        return self.norms
+
+    def sync(self):
+        """
+        Brings the index up to date with the stored entries, re-indexing only
+        entries whose stamp changed. Returns True if anything changed.
+        """
+        titles = util.list_entries()
+        changed = False
+        for title in set(self.docs) - set(titles):
+            self.remove(title)
+            changed = True
+        for title in titles:
+            stamp = util.entry_stamp(title)
+            doc = self.docs.get(title)
+            if doc is not None and doc[0] == stamp:
+                continue
+            content = util.get_entry(title)
+            if content is None:
+                continue
+            self.add(title, content, stamp)
+            changed = True
+        return changed
+
+    def dump(self):
+        with self.lock:
+            docs = {title: [list(stamp) if stamp else None, counts]
+                    for title, (stamp, counts) in self.docs.items()}
+        return {"format": INDEX_FORMAT, "docs": docs}
+
+    @classmethod
+    def from_dump(cls, data):
+        index = cls()
+        if data.get("format") != INDEX_FORMAT:
+            return index
+        for title, (stamp, counts) in data.get("docs", {}).items():
+            index._insert(title, tuple(stamp) if stamp else None, counts)
+        return index
+
+
+# Process-wide index, loaded lazily and written back after updates
+_store = PersistedIndex(INDEX_PATH, SearchIndex)
+
+
+def get_index():
+    """
+    Returns the process-wide search index, loading it on first use and
+    reloading it when another process has written a newer copy.
+    """
+    return _store.get()
+
+
+def persist():
+    """
+    Writes the index to INDEX_PATH atomically.
+    """
+    _store.persist()
+
+
+@timed("search")
+def search_entries(query, limit=None):
+    """
+    Returns entry titles matching a full-text query, most relevant first.
+    """
+    return get_index().search(query, limit)
+
+
+@receiver(entry_saved)
+def _update_on_save(sender, title, content, **kwargs):
+    index = _store.loaded()
+    if index is None:
+        # Not loaded yet; the stamp check on load will pick the change up
+        return
+    index.add(title, content, util.entry_stamp(title))
+    _store.schedule_persist()
+
+
+@receiver(entry_deleted)
+def _update_on_delete(sender, title, **kwargs):
+    index = _store.loaded()
+    if index is None:
+        return
+    index.remove(title)
+    _store.schedule_persist()
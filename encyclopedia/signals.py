@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent by util.save_entry once an entry has been written.
+# Keyword arguments: title, content (the new Markdown source).
+entry_saved = Signal()
+
+# Sent by util.delete_entry once an entry has been removed.
+# Keyword arguments: title.
+entry_deleted = Signal()
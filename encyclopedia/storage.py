@@ -0,0 +1,487 @@
+"""
+Entry storage backends.
+
+util.py talks to the store through the backend named by the
+WIKI_STORAGE_BACKEND setting:
+
+- FilesystemBackend: Markdown files under entries/ and metadata in
+  datas/wikis.json (the original layout).
+- DatabaseBackend: content, metadata and the title index in the configured
+  database (SQLite by default), every write in one transaction. Use
+  `manage.py migrate_storage` to import the existing files.
+
+Every backend provides the same methods; "stamps" are cheap, hashable
+version markers whose first element is a modification time in nanoseconds.
+"""
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+META_PATH = "datas/wikis.json"
+META_JOURNAL_PATH = "datas/wikis.log"
+META_LOCK_PATH = "datas/wikis.lock"
+# Journal lines before compaction (or a quarter of the records, if larger)
+META_COMPACT_MIN = 64
+
+# SQLite refuses statements with too many parameters
+_IN_BATCH = 500
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def meta_key(title):
+    """
+    Normalized title used to detect duplicate metadata (case-insensitive).
+    """
+    return title.strip().casefold()
+
+
+def get_backend():
+    """
+    Returns the process-wide backend instance named by WIKI_STORAGE_BACKEND.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = getattr(settings, "WIKI_STORAGE_BACKEND", "encyclopedia.storage.FilesystemBackend")
+            _backend = import_string(path)()
+        return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting in ("WIKI_STORAGE_BACKEND", "MEDIA_ROOT"):
+        with _backend_lock:
+            _backend = None
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    Holds an exclusive lock on `path` across processes.
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_base(path):
+    # Read file as bytes and decode using utf-8 to preserve special chars
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+    except FileNotFoundError:
+        return []
+    except Exception:
+        return []
+
+
+def _index_records(records):
+    by_title = {}
+    for entry in records:
+        # First record wins, as the old linear scan did
+        by_title.setdefault(meta_key(entry.get('title', '')), entry)
+    return by_title
+
+
+def _read_journal(path, offset):
+    """
+    Returns (operations, bytes consumed) for the complete lines after
+    `offset`. A trailing line still being written is left for later.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    ops = [json.loads(line) for line in data[:end].decode("utf-8").splitlines() if line.strip()]
+    return ops, end
+
+
+def _replay(records, by_title, ops):
+    for op in ops:
+        if op.get("op") == "add":
+            key = meta_key(op["record"].get("title", ""))
+            # Already present when replaying a journal that was compacted
+            # but not yet truncated
+            if key not in by_title:
+                records.append(op["record"])
+                by_title[key] = op["record"]
+        elif op.get("op") == "update":
+            entry = by_title.get(meta_key(op["title"]))
+            if entry is not None:
+                entry.update(op["fields"])
+
+
+def read_metadata(base_path, journal_path):
+    """
+    Returns the metadata records stored in a wikis.json file plus its
+    journal. Used by the static builder, which reads the files directly.
+    """
+    records = _read_base(base_path)
+    if os.path.exists(journal_path):
+        ops, _ = _read_journal(journal_path, 0)
+        _replay(records, _index_records(records), ops)
+    return records
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class FilesystemBackend:
+    """
+    Entries as entries/<title>.md and metadata as a JSON list in
+    datas/wikis.json, both under default_storage. The title list and a
+    casefolded-title metadata index are kept in memory and reloaded only
+    when the directory or file stamp changes.
+
+    Metadata writes are appended to the datas/wikis.log journal under an
+    exclusive file lock, so concurrent writers in several processes cannot
+    lose each other's records and a write costs O(1) instead of rewriting
+    the whole file. The journal is periodically folded back into
+    datas/wikis.json with an atomic rename.
+    """
+
+    def __init__(self):
+        self.titles = (False, [])
+        self.meta = {"stamp": False, "offset": 0, "lines": 0, "records": [], "by_title": {}}
+        self.meta_lock = threading.Lock()
+
+    # Entries
+
+    def _entry_path(self, title):
+        return default_storage.path(f"entries/{title}.md")
+
+    def catalog_stamp(self):
+        return _stamp(default_storage.path("entries"))
+
+    def list_entries(self):
+        stamp = self.catalog_stamp()
+        cached_stamp, titles = self.titles
+        if stamp != cached_stamp:
+            _, filenames = default_storage.listdir("entries")
+            titles = sorted(re.sub(r"\.md$", "", filename)
+                            for filename in filenames if filename.endswith(".md"))
+            self.titles = (stamp, titles)
+        return list(titles)
+
+    def entry_stamp(self, title):
+        return _stamp(self._entry_path(title))
+
+    def get_entry(self, title):
+        try:
+            f = default_storage.open(f"entries/{title}.md", "rb")
+            raw = f.read()
+            if isinstance(raw, bytes):
+                return raw.decode("utf-8")
+            return raw
+        except FileNotFoundError:
+            return None
+
+    def save_entry(self, title, content):
+        # Write to a temporary file and rename it over the old one, so readers
+        # see either the old or the new content, never a missing or partial file
+        path = self._entry_path(title)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content.encode("utf-8"))
+        os.replace(tmp_path, path)
+
+    def delete_entry(self, title):
+        filename = f"entries/{title}.md"
+        if default_storage.exists(filename):
+            default_storage.delete(filename)
+
+    # Metadata
+
+    def _meta_paths(self):
+        return (default_storage.path(META_PATH), default_storage.path(META_JOURNAL_PATH),
+                default_storage.path(META_LOCK_PATH))
+
+    def meta_stamp(self):
+        base_path, journal_path, _ = self._meta_paths()
+        return (_stamp(base_path), _stamp(journal_path))
+
+    def _load_meta(self):
+        """
+        Returns the metadata index, catching up with the journal by reading
+        only the lines appended since the last call. datas/wikis.json is
+        re-read only when it changed (i.e. after a compaction).
+        Must be called with meta_lock held.
+        """
+        base_path, journal_path, _ = self._meta_paths()
+        base_stamp = _stamp(base_path)
+        journal_size = _stamp(journal_path)[1] if os.path.exists(journal_path) else 0
+        meta = self.meta
+        if base_stamp != meta["stamp"] or journal_size < meta["offset"]:
+            records = _read_base(base_path)
+            meta = self.meta = {"stamp": base_stamp, "offset": 0, "lines": 0,
+                                "records": records, "by_title": _index_records(records)}
+        if journal_size > meta["offset"]:
+            try:
+                ops, consumed = _read_journal(journal_path, meta["offset"])
+            except ValueError:
+                # Read while another process compacted; reload from scratch next time
+                meta["stamp"] = False
+                return meta
+            _replay(meta["records"], meta["by_title"], ops)
+            meta["offset"] += consumed
+            meta["lines"] += len(ops)
+        return meta
+
+    def _append(self, *ops):
+        """
+        Appends operations to the journal (one write and fsync) and applies
+        them to the index. Must be called with meta_lock and the file lock held.
+        """
+        _, journal_path, _ = self._meta_paths()
+        lines = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops).encode("utf-8")
+        with open(journal_path, "ab") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        _replay(self.meta["records"], self.meta["by_title"], ops)
+        self.meta["offset"] = offset
+        self.meta["lines"] += len(ops)
+        # Compacting once the journal is a fraction of the file keeps writes amortized O(1)
+        if self.meta["lines"] >= max(META_COMPACT_MIN, len(self.meta["records"]) // 4):
+            self._compact()
+
+    def _compact(self):
+        """
+        Folds the journal into datas/wikis.json (temp file + os.replace) and
+        truncates it. Must be called with meta_lock and the file lock held.
+        """
+        base_path, journal_path, _ = self._meta_paths()
+        # Write JSON using utf-8 bytes so special characters are preserved
+        content_bytes = json.dumps(self.meta["records"], indent=2, ensure_ascii=False).encode('utf-8')
+        tmp_path = f"{base_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, base_path)
+        # A crash before this truncate only means replaying ops that are
+        # already in the file, which _replay tolerates
+        with open(journal_path, "wb"):
+            pass
+        self.meta.update(stamp=_stamp(base_path), offset=0, lines=0)
+
+    def _locked(self):
+        base_path, _, lock_path = self._meta_paths()
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        return _file_lock(lock_path)
+
+    def compact(self):
+        """
+        Folds any journaled metadata writes into datas/wikis.json now.
+        """
+        with self.meta_lock, self._locked():
+            self._load_meta()
+            if self.meta["lines"]:
+                self._compact()
+
+    def get_meta(self, title):
+        with self.meta_lock:
+            return self._load_meta()["by_title"].get(meta_key(title))
+
+    def get_metas(self, titles):
+        with self.meta_lock:
+            by_title = self._load_meta()["by_title"]
+        found = {}
+        for title in titles:
+            entry = by_title.get(meta_key(title))
+            if entry is not None:
+                found[title] = entry
+        return found
+
+    def all_meta(self):
+        with self.meta_lock:
+            return list(self._load_meta()["records"])
+
+    def add_meta(self, record):
+        # The file lock makes check-then-append atomic across worker processes
+        with self.meta_lock, self._locked():
+            index = self._load_meta()
+            if meta_key(record["title"]) in index["by_title"]:
+                return False
+            self._append({"op": "add", "record": record})
+        return True
+
+    def add_metas(self, records):
+        with self.meta_lock, self._locked():
+            index = self._load_meta()
+            added, keys = [], set()
+            for record in records:
+                key = meta_key(record["title"])
+                if key not in index["by_title"] and key not in keys:
+                    keys.add(key)
+                    added.append(record)
+            if added:
+                self._append(*({"op": "add", "record": record} for record in added))
+        return [record["title"] for record in added]
+
+    def update_meta(self, title, fields):
+        with self.meta_lock, self._locked():
+            index = self._load_meta()
+            if meta_key(title) not in index["by_title"]:
+                return False
+            self._append({"op": "update", "title": title, "fields": fields})
+        return True
+
+
+class DatabaseBackend:
+    """
+    Entries and metadata stored in the default database through the Entry
+    and EntryMeta models. Titles are indexed (EntryMeta.title_key is the
+    unique casefolded title), and every write is a single transaction.
+    """
+
+    def __init__(self):
+        from .models import Entry, EntryMeta
+
+        self.Entry = Entry
+        self.EntryMeta = EntryMeta
+
+    @staticmethod
+    def _ns(moment):
+        return int(moment.timestamp() * 1_000_000) * 1000
+
+    # Entries
+
+    def catalog_stamp(self):
+        from django.db.models import Count, Max
+
+        stats = self.Entry.objects.aggregate(count=Count("id"), updated=Max("updated"))
+        if stats["updated"] is None:
+            return None
+        return (self._ns(stats["updated"]), stats["count"])
+
+    def list_entries(self):
+        return list(self.Entry.objects.order_by("title").values_list("title", flat=True))
+
+    def entry_stamp(self, title):
+        row = self.Entry.objects.filter(title=title).values_list("updated", "size").first()
+        return (self._ns(row[0]), row[1]) if row else None
+
+    def get_entry(self, title):
+        return self.Entry.objects.filter(title=title).values_list("content", flat=True).first()
+
+    def save_entry(self, title, content):
+        from django.db import transaction
+
+        with transaction.atomic():
+            self.Entry.objects.update_or_create(
+                title=title, defaults={"content": content, "size": len(content.encode("utf-8"))})
+
+    def delete_entry(self, title):
+        self.Entry.objects.filter(title=title).delete()
+
+    # Metadata
+
+    def meta_stamp(self):
+        from django.db.models import Count, Max
+
+        stats = self.EntryMeta.objects.aggregate(count=Count("id"), updated=Max("updated"))
+        if stats["updated"] is None:
+            return None
+        return (self._ns(stats["updated"]), stats["count"])
+
+    def get_meta(self, title):
+        meta = self.EntryMeta.objects.filter(title_key=meta_key(title)).first()
+        return meta.as_record() if meta else None
+
+    def get_metas(self, titles):
+        titles = list(titles)
+        by_key = {}
+        keys = list({meta_key(title) for title in titles})
+        for start in range(0, len(keys), _IN_BATCH):
+            for meta in self.EntryMeta.objects.filter(title_key__in=keys[start:start + _IN_BATCH]):
+                by_key[meta.title_key] = meta.as_record()
+        found = {}
+        for title in titles:
+            record = by_key.get(meta_key(title))
+            if record is not None:
+                found[title] = record
+        return found
+
+    def all_meta(self):
+        return [meta.as_record() for meta in self.EntryMeta.objects.order_by("id")]
+
+    def add_meta(self, record):
+        from django.db import IntegrityError, transaction
+
+        try:
+            with transaction.atomic():
+                self.EntryMeta.from_record(record).save()
+        except IntegrityError:
+            # Unique title_key: the title already has metadata
+            return False
+        return True
+
+    def add_metas(self, records):
+        from django.db import transaction
+
+        new = {}
+        for record in records:
+            new.setdefault(meta_key(record["title"]), record)
+        keys = list(new)
+        with transaction.atomic():
+            for start in range(0, len(keys), _IN_BATCH):
+                existing = self.EntryMeta.objects.filter(title_key__in=keys[start:start + _IN_BATCH])
+                for key in existing.values_list("title_key", flat=True):
+                    del new[key]
+            self.EntryMeta.objects.bulk_create(
+                [self.EntryMeta.from_record(record) for record in new.values()], batch_size=_IN_BATCH)
+        return [record["title"] for record in new.values()]
+
+    def compact(self):
+        # Every write already lands in its table
+        pass
+
+    def update_meta(self, title, fields):
+        from django.db import transaction
+
+        with transaction.atomic():
+            meta = self.EntryMeta.objects.select_for_update().filter(title_key=meta_key(title)).first()
+            if meta is None:
+                return False
+            record = meta.as_record()
+            record.update(fields)
+            updated = self.EntryMeta.from_record(record)
+            updated.pk = meta.pk
+            updated.save()
+        return True
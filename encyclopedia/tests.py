@@ -1,3 +1,734 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+
+from . import async_views, links, render, revisions, search, storage, util, views
+from .management.commands import bulk_entries
+from .storage import DatabaseBackend, FilesystemBackend
+
+
+class TempMediaMixin:
+    """
+    Runs each test with MEDIA_ROOT (entries/, datas/) in a fresh temporary
+    directory.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        os.makedirs(os.path.join(self.tmp.name, "entries"))
+        os.makedirs(os.path.join(self.tmp.name, "datas"))
+        settings_override = override_settings(MEDIA_ROOT=self.tmp.name, CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "fragments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests"},
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp.name, *parts)
+
+    def write_entry(self, title, content):
+        with open(self.path("entries", f"{title}.md"), "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+class MetadataJournalTests(TempMediaMixin, SimpleTestCase):
+
+    def write_base(self, records):
+        with open(self.path(storage.META_PATH), "w", encoding="utf-8") as f:
+            json.dump(records, f)
+
+    def test_replay_skips_a_truncated_last_line(self):
+        self.write_base([{"title": "Python", "category": "Lenguaje", "author": "Ana"}])
+        complete = json.dumps({"op": "add", "record": {"title": "Django", "category": "Web", "author": "Luis"}})
+        partial = json.dumps({"op": "add", "record": {"title": "Git", "category": "Tool", "author": "Eva"}})
+        # A writer crashed halfway through its line
+        with open(self.path(storage.META_JOURNAL_PATH), "w", encoding="utf-8") as f:
+            f.write(complete + "\n" + partial[:20])
+
+        backend = FilesystemBackend()
+        self.assertEqual(backend.get_meta("django")["author"], "Luis")
+        self.assertIsNone(backend.get_meta("Git"))
+        self.assertEqual([record["title"] for record in backend.all_meta()], ["Python", "Django"])
+        self.assertEqual([record["title"] for record in storage.read_metadata(
+            self.path(storage.META_PATH), self.path(storage.META_JOURNAL_PATH))], ["Python", "Django"])
+
+        # Once the line is complete it is picked up incrementally
+        with open(self.path(storage.META_JOURNAL_PATH), "a", encoding="utf-8") as f:
+            f.write(partial[20:] + "\n")
+        self.assertEqual(backend.get_meta("git")["category"], "Tool")
+
+    def test_replay_after_compaction_without_truncate(self):
+        record = {"title": "Python", "category": "Lenguaje", "author": "Ana"}
+        self.write_base([record])
+        # Crash between the os.replace and the truncate: the op is in both
+        with open(self.path(storage.META_JOURNAL_PATH), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "add", "record": record}) + "\n")
+            f.write(json.dumps({"op": "update", "title": "python", "fields": {"author": "Eva"}}) + "\n")
+
+        backend = FilesystemBackend()
+        self.assertEqual(len(backend.all_meta()), 1)
+        self.assertEqual(backend.get_meta("Python")["author"], "Eva")
+
+    def test_compaction_replaces_the_base_file(self):
+        backend = FilesystemBackend()
+        titles = [f"Entrada {i}" for i in range(storage.META_COMPACT_MIN)]
+        with mock.patch("encyclopedia.storage.os.replace", wraps=os.replace) as replace:
+            for title in titles[:-1]:
+                self.assertTrue(backend.add_meta({"title": title, "category": "", "author": ""}))
+            replace.assert_not_called()
+            self.assertTrue(backend.add_meta({"title": titles[-1], "category": "", "author": ""}))
+
+        base_path = self.path(storage.META_PATH)
+        replace.assert_called_once()
+        tmp_path, target = replace.call_args[0]
+        self.assertEqual(target, base_path)
+        self.assertFalse(os.path.exists(tmp_path))
+        self.assertEqual(os.path.getsize(self.path(storage.META_JOURNAL_PATH)), 0)
+        with open(base_path, encoding="utf-8") as f:
+            self.assertEqual([record["title"] for record in json.load(f)], titles)
+
+        # Writes after the compaction land in the journal again
+        self.assertTrue(backend.update_meta("entrada 0", {"author": "Ana"}))
+        self.assertFalse(backend.add_meta({"title": "ENTRADA 1", "category": "", "author": ""}))
+        fresh = FilesystemBackend()
+        self.assertEqual(fresh.get_meta("Entrada 0")["author"], "Ana")
+        self.assertEqual(len(fresh.all_meta()), len(titles))
+
+    def test_concurrent_writers(self):
+        # One backend per thread, as in separate worker processes: only the
+        # file lock keeps them from losing each other's records
+        writers, per_writer = 8, 40
+        barrier = threading.Barrier(writers)
+        results = [None] * writers
+        errors = []
+
+        def write(number):
+            try:
+                backend = FilesystemBackend()
+                barrier.wait()
+                added = [backend.add_meta({"title": f"W{number}-{i}", "category": "", "author": ""})
+                         for i in range(per_writer)]
+                # Every writer also races for the same title
+                added.append(backend.add_meta({"title": "Compartida", "category": "", "author": str(number)}))
+                backend.update_meta(f"W{number}-0", {"author": "editado"})
+                results[number] = added
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(all(all(added[:-1]) for added in results))
+        self.assertEqual(sum(added[-1] for added in results), 1)
+        records = FilesystemBackend().all_meta()
+        titles = [record["title"] for record in records]
+        self.assertEqual(len(titles), len(set(titles)))
+        self.assertEqual(len(titles), writers * per_writer + 1)
+        by_title = {record["title"]: record for record in records}
+        for number in range(writers):
+            self.assertEqual(by_title[f"W{number}-0"]["author"], "editado")
+
+
+class DatabaseBackendTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_entry("Python", "# Python\n\nUn lenguaje.\n")
+        self.write_entry("Café", "Con acento: ☕\n")
+        with open(self.path(storage.META_PATH), "w", encoding="utf-8") as f:
+            json.dump([{"title": "Python", "category": "Lenguaje", "author": "Ana"},
+                       {"title": "Café", "category": "Bebida", "author": "Luis", "images": {"webp": "cafe.webp"}}], f)
+        call_command("migrate_storage", stdout=io.StringIO())
+        self.backend = DatabaseBackend()
+
+    def test_migrate_storage_copies_entries_and_metadata(self):
+        self.assertEqual(self.backend.list_entries(), ["Café", "Python"])
+        self.assertEqual(self.backend.get_entry("Café"), "Con acento: ☕\n")
+        self.assertEqual(self.backend.entry_stamp("Café")[1], len("Con acento: ☕\n".encode("utf-8")))
+        self.assertEqual(self.backend.get_meta("café")["images"], {"webp": "cafe.webp"})
+        self.assertEqual(self.backend.all_meta(), FilesystemBackend().all_meta())
+        # Re-running overwrites entries and keeps the metadata already there
+        self.write_entry("Python", "Editado.\n")
+        out = io.StringIO()
+        call_command("migrate_storage", stdout=out)
+        self.assertIn("0 new metadata records (2 already present)", out.getvalue())
+        self.assertEqual(self.backend.get_entry("Python"), "Editado.\n")
+
+    def test_entries_round_trip(self):
+        self.assertIsNone(self.backend.get_entry("Go"))
+        self.assertIsNone(self.backend.entry_stamp("Go"))
+        self.backend.save_entry("Go", "Un lenguaje.\n")
+        self.backend.save_entry("Go", "Otro lenguaje.\n")
+        self.assertEqual(self.backend.get_entry("Go"), "Otro lenguaje.\n")
+        self.assertEqual(self.backend.list_entries(), ["Café", "Go", "Python"])
+        self.backend.delete_entry("Go")
+        self.assertEqual(self.backend.list_entries(), ["Café", "Python"])
+
+    def test_metadata_round_trip(self):
+        record = {"title": "Go", "category": "Lenguaje", "author": "Eva"}
+        self.assertTrue(self.backend.add_meta(record))
+        self.assertEqual(self.backend.get_meta("GO"), record)
+        self.assertEqual(self.backend.get_metas(["go", "Python", "Rust"]),
+                         {"go": record, "Python": {"title": "Python", "category": "Lenguaje", "author": "Ana"}})
+
+        added = self.backend.add_metas([
+            {"title": "Rust", "category": "Lenguaje", "author": "Eva"},
+            {"title": "RUST", "category": "Duplicado", "author": "Eva"},
+            {"title": "python", "category": "Ya existe", "author": "Eva"},
+        ])
+        self.assertEqual(added, ["Rust"])
+        self.assertEqual(self.backend.get_meta("rust")["category"], "Lenguaje")
+        self.assertEqual(self.backend.get_meta("Python")["category"], "Lenguaje")
+
+        self.assertTrue(self.backend.update_meta("go", {"author": "Ana", "images": {"webp": "go.webp"}}))
+        self.assertEqual(self.backend.get_meta("Go"), dict(record, author="Ana", images={"webp": "go.webp"}))
+        self.assertFalse(self.backend.update_meta("Haskell", {"author": "Ana"}))
+
+    def test_case_insensitive_duplicate_is_rejected(self):
+        # The unique title_key raises IntegrityError, caught in a savepoint
+        self.assertFalse(self.backend.add_meta({"title": "PYTHON", "category": "Otra", "author": "Eva"}))
+        self.assertFalse(self.backend.add_meta({"title": "CAFÉ", "category": "Otra", "author": "Eva"}))
+        # The surrounding transaction is still usable
+        self.assertTrue(self.backend.add_meta({"title": "Go", "category": "Lenguaje", "author": "Eva"}))
+        self.assertEqual([record["title"] for record in self.backend.all_meta()], ["Python", "Café", "Go"])
+        self.assertEqual(self.backend.get_meta("python")["author"], "Ana")
+
+
+@override_settings(WIKI_REVISIONS=False)
+class BulkImportTests(TempMediaMixin, TestCase):
+
+    def files(self):
+        titles = [f"Entrada {number:03}" for number in range(80)] + ["Café"]
+        # Stored in reverse title order, unlike the import
+        files = {f"entries/{title}.md": f"# {title}\n\nTexto de {title}.\n".encode("utf-8")
+                 for title in reversed(titles)}
+        files["wikis.json"] = json.dumps(
+            [{"title": title, "category": "Prueba", "author": "Ana"} for title in titles]).encode("utf-8")
+        files["notas.txt"] = b"ignorado"
+        files["../fuera.md"] = b"# Fuera del directorio\n"
+        return titles, files
+
+    def import_archive(self, name, write):
+        titles, files = self.files()
+        archive = self.path(name)
+        write(archive, files)
+        out = io.StringIO()
+        call_command("bulk_entries", "import", archive, "--batch-size", "16", stdout=out)
+        self.assertIn(f"Imported {len(titles)} entries", out.getvalue())
+        self.assertEqual(util.list_entries(), sorted(titles))
+        self.assertEqual(util.get_entry("Café"), "# Café\n\nTexto de Café.\n")
+        self.assertEqual(util.get_meta("café")["author"], "Ana")
+        self.assertFalse(os.path.exists(self.path("fuera.md")))
+        # The journal was folded into wikis.json
+        with open(self.path(storage.META_PATH), encoding="utf-8") as f:
+            self.assertEqual(sorted(record["title"] for record in json.load(f)), sorted(titles))
+        self.assertEqual(os.path.getsize(self.path(storage.META_JOURNAL_PATH)), 0)
+
+    def test_tar_gz(self):
+        def write(archive, files):
+            with tarfile.open(archive, "w:gz") as tar:
+                for name, data in files.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+
+        # Small members stay in memory, wikis.json goes through the temporary directory
+        with mock.patch.object(bulk_entries, "SPOOL_MAX", 64):
+            self.import_archive("entradas.tar.gz", write)
+
+    def test_zip(self):
+        def write(archive, files):
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+                for name, data in files.items():
+                    zf.writestr(name, data)
+
+        self.import_archive("entradas.zip", write)
+
+
+class LinkGraphTests(TempMediaMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        links._store.reset()
+        self.addCleanup(links._store.reset)
+        # The graph is read from the Markdown source: nothing may render
+        render_patch = mock.patch("encyclopedia.render.render", side_effect=AssertionError("rendered"))
+        render_patch.start()
+        self.addCleanup(render_patch.stop)
+
+    def test_cold_start_reads_the_sources(self):
+        self.write_entry("Python", "Ver [Django](/wiki/Django) y [Go](/wiki/Go).\n\n`[no](/wiki/Code)`\n")
+        self.write_entry("Django", "Escrito en [Python](/wiki/Python \"Lenguaje\").\n")
+        self.assertEqual(links.backlinks("Django"), ["Python"])
+        self.assertEqual(links.backlinks("Python"), ["Django"])
+        self.assertEqual(links.broken_links(), {"Go": ["Python"]})
+
+    def test_save_and_delete_update_the_graph(self):
+        self.write_entry("Python", "Sin enlaces.\n")
+        self.assertEqual(links.backlinks("Go"), [])
+        with override_settings(WIKI_REVISIONS=False):
+            util.save_entry("Python", "Ahora con [Go](/wiki/Go).\n")
+            self.assertEqual(links.backlinks("Go"), ["Python"])
+            util.delete_entry("Python")
+        self.assertEqual(links.broken_links(), {})
+
+
+class SearchTests(TempMediaMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        search._store.reset()
+        self.addCleanup(search._store.reset)
+
+    def test_accents_and_case_are_folded(self):
+        self.write_entry("Café", "Bebida hecha con granos tostados.\n")
+        self.write_entry("Té", "Infusión de hojas. NADA que ver con el café.\n")
+        self.assertEqual(search.search_entries("cafe"), ["Café", "Té"])
+        self.assertEqual(search.search_entries("INFUSION"), ["Té"])
+        self.assertEqual(search.search_entries("granós"), ["Café"])
+
+    def test_title_and_frequency_rank_first(self):
+        self.write_entry("Python", "Un lenguaje.\n")
+        self.write_entry("Django", "Framework escrito en Python, como Flask.\n")
+        self.write_entry("Flask", "Otro framework. Usa Python, Python y más Python.\n")
+        self.assertEqual(search.search_entries("python"), ["Python", "Flask", "Django"])
+        self.assertEqual(search.search_entries("python", limit=2), ["Python", "Flask"])
+
+    @override_settings(WIKI_REVISIONS=False)
+    def test_save_and_delete_update_the_loaded_index(self):
+        self.write_entry("Python", "Un lenguaje.\n")
+        self.assertEqual(search.search_entries("serpiente"), [])
+        index = search.get_index()
+        with mock.patch.object(search.SearchIndex, "sync", side_effect=AssertionError("full sync")):
+            util.save_entry("Python", "Se llama así por Monty Python, no por la serpiente.\n")
+            util.save_entry("Pitón", "Una serpiente.\n")
+            self.assertIs(search.get_index(), index)
+            self.assertEqual(search.search_entries("serpiente"), ["Pitón", "Python"])
+            util.delete_entry("Pitón")
+            self.assertEqual(search.search_entries("serpiente"), ["Python"])
+
+    @override_settings(WIKI_SEARCH_RESULTS=3)
+    def test_results_page_is_limited(self):
+        titles = [f"Entrada {number}" for number in range(6)] + ["Comunes"]
+        for number, title in enumerate(titles):
+            self.write_entry(title, "Texto común.\n" * (number + 1) if number < 6 else "Nada más.\n")
+        with open(self.path(storage.META_PATH), "w", encoding="utf-8") as f:
+            json.dump([{"title": title, "category": "Prueba", "author": "Ana"} for title in titles], f)
+        response = self.client.get(reverse("search") + "?q=comun")
+        self.assertEqual(response.content.decode().count('class="card card--1"'), 3)
+        self.assertEqual(views._search_results("comun"), ["Entrada 5", "Entrada 4", "Entrada 3"])
+        # Partial and fuzzy title matches fill the page when few entries rank
+        self.assertEqual(views._search_results("Entrad"), ["Entrada 0", "Entrada 1", "Entrada 2"])
+
+
+class IndexPagingTests(TempMediaMixin, SimpleTestCase):
+
+    def write_catalog(self, count, category=lambda number: "Lenguaje"):
+        titles = [f"Entrada {number:03}" for number in range(count)]
+        for title in titles:
+            self.write_entry(title, f"# {title}\n")
+        with open(self.path(storage.META_PATH), "w", encoding="utf-8") as f:
+            json.dump([{"title": title, "category": category(number), "author": "Ana"}
+                       for number, title in enumerate(titles)], f)
+        return titles
+
+    def pages(self, limit, **filters):
+        pages, cursor = [], None
+        while True:
+            cards, cursor = util.page_entries(cursor, limit, **filters)
+            pages.append([card["title"] for card in cards])
+            if cursor is None:
+                return pages
+
+    def test_exact_multiple_of_the_page_size(self):
+        titles = self.write_catalog(10)
+        cards, cursor = util.page_entries(None, 5)
+        self.assertEqual(cursor, "Entrada 004")
+        cards, cursor = util.page_entries(cursor, 5)
+        self.assertEqual([card["title"] for card in cards], titles[5:])
+        # No trailing empty page
+        self.assertIsNone(cursor)
+        self.assertEqual(self.pages(10), [titles])
+
+    def test_filters_skip_whole_batches(self):
+        # Batches hold 64 titles: the matches are in the third one
+        titles = self.write_catalog(150, lambda number: "Raro" if number in (3, 140, 141, 149) else "Común")
+        self.write_entry("Sin metadata", "Nada.\n")
+        self.assertEqual(self.pages(2, category="raro"),
+                         [["Entrada 003", "Entrada 140"], ["Entrada 141", "Entrada 149"]])
+        self.assertEqual(self.pages(3, category="RARO", author="ana"),
+                         [["Entrada 003", "Entrada 140", "Entrada 141"], ["Entrada 149"]])
+        self.assertEqual(self.pages(5, category="Ninguna"), [[]])
+        self.assertEqual(sum(self.pages(48), []), titles)
+
+    @override_settings(WIKI_INDEX_PAGE_SIZE=5)
+    def test_streamed_index_holds_every_card_once(self):
+        titles = self.write_catalog(15, lambda number: "Par" if number % 2 == 0 else "Impar")
+        for query, expected in (("", titles), ("?category=par", titles[::2])):
+            response = self.client.get(reverse("index_all") + query)
+            self.assertTrue(response.streaming)
+            body = b"".join(response.streaming_content).decode()
+            self.assertEqual(body.count('class="card card--1"'), len(expected), query)
+            for title in expected:
+                self.assertEqual(body.count(f'href="{reverse("wiki", args=[title])}"'), 1, title)
+            self.assertNotIn(views.STREAM_MARKER, body)
+            self.assertTrue(body.rstrip().endswith("</html>"))
+
+
+class StaleRenderingTests(TempMediaMixin, SimpleTestCase):
+
+    def test_entry_changed_elsewhere_serves_the_previous_rendering(self):
+        self.write_entry("Obsoleta", "# Primera\n")
+        digest, html = util.get_entry_rendering("Obsoleta")
+        self.assertIn("Primera", html)
+
+        gate = threading.Event()
+        render_markdown = util.render_markdown
+
+        def slow_render(content):
+            gate.wait(5)
+            return render_markdown(content)
+
+        # Saved by another worker: this process only sees the file change
+        self.write_entry("Obsoleta", "# Segunda versión\n")
+        with mock.patch.object(util, "render_markdown", side_effect=slow_render):
+            self.assertEqual(util.get_entry_rendering("Obsoleta"), (digest, html))
+            self.assertEqual(asyncio.run(util.aget_entry_rendering("Obsoleta")), (digest, html))
+            gate.set()
+            self.assertIn("Segunda", util.get_entry_html("Obsoleta"))
+        new_digest, new_html = util.get_entry_rendering("Obsoleta")
+        self.assertNotEqual(new_digest, digest)
+        self.assertIn("Segunda", new_html)
+        self.assertEqual(asyncio.run(util.aget_entry_html("Obsoleta")), new_html)
+
+
+    def test_previous_rendering_has_no_last_modified(self):
+        self.write_entry("Anterior", "# Primera\n")
+        url = reverse("wiki", args=["Anterior"])
+        first = self.client.get(url)
+        self.assertIn("Last-Modified", first)
+
+        gate = threading.Event()
+        render_markdown = util.render_markdown
+
+        def slow_render(content):
+            gate.wait(5)
+            return render_markdown(content)
+
+        self.write_entry("Anterior", "# Segunda versión\n")
+        path = self.path("entries", "Anterior.md")
+        saved = os.path.getmtime(path) + 10
+        os.utime(path, (saved, saved))
+        factory = RequestFactory()
+        # The async view renders its template on the render executor: not
+        # behind the blocked render, even with a single CPU
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(util, "render_markdown", side_effect=slow_render), \
+                mock.patch.object(util, "_render_executor", executor):
+            stale = self.client.get(url)
+            stale_async = asyncio.run(async_views.wiki(factory.get(url), "Anterior"))
+            for response in (stale, stale_async):
+                self.assertIn("Primera", response.content.decode())
+                self.assertEqual(response["ETag"], first["ETag"])
+                # Not the new file's date, which would answer this with a 304
+                self.assertNotIn("Last-Modified", response)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(saved)).status_code, 200)
+            gate.set()
+            util.get_entry_html("Anterior")
+        fresh = self.client.get(url)
+        self.assertIn("Segunda", fresh.content.decode())
+        self.assertEqual(fresh["Last-Modified"], http_date(saved))
+
+
+    @override_settings(WIKI_REVISIONS=False, WIKI_HTML_CACHE_SIZE=2)
+    def test_previous_renderings_are_bounded(self):
+        titles = [f"Guardada {number}" for number in range(4)]
+        for title in titles:
+            self.write_entry(title, f"# {title}\n")
+            util.get_entry_html(title)
+            # Saved and never read again
+            util.save_entry(title, f"# {title}, editada\n")
+        self.assertEqual([title for title in util._stale_html if title in titles], titles[2:])
+
+    def test_warm_cache_only_writes_the_indexes(self):
+        self.write_entry("Python", "Ver [Django](/wiki/Django).\n")
+        search._store.reset()
+        links._store.reset()
+        self.addCleanup(search._store.reset)
+        self.addCleanup(links._store.reset)
+        with mock.patch.object(util, "render_markdown", side_effect=AssertionError("rendered")):
+            call_command("warm_cache", stdout=io.StringIO())
+        with open(self.path(search.INDEX_PATH), encoding="utf-8") as f:
+            self.assertIn("Python", json.load(f)["docs"])
+        with open(self.path(links.GRAPH_PATH), encoding="utf-8") as f:
+            self.assertIn("Django", f.read())
+
+
+@override_settings(WIKI_REVISIONS=True, WIKI_REVISION_SNAPSHOT_EVERY=4)
+class RevisionTests(TempMediaMixin, SimpleTestCase):
+
+    def versions(self):
+        lines = [f"Línea {i} de la entrada.\n" for i in range(40)]
+        versions = ["".join(lines)]
+        for step in range(1, 11):
+            if step == 6:
+                # A rewrite, stored whole even between snapshots
+                lines = [f"Otro texto {i}\n" for i in range(30)]
+            else:
+                lines[step * 2] = f"Línea {step * 2} cambiada en la versión {step}.\n"
+                lines.insert(step, "Nueva línea ✓\n")
+                del lines[-1]
+            versions.append("".join(lines))
+        return versions
+
+    def test_every_revision_round_trips(self):
+        versions = self.versions()
+        for number, content in enumerate(versions, 1):
+            self.assertEqual(revisions.record("Historia", content, timestamp=1000 + number), number)
+        self.assertIsNone(revisions.record("Historia", versions[-1]))
+
+        history = revisions.history("Historia")
+        self.assertEqual([entry["number"] for entry in history], list(range(1, len(versions) + 1)))
+        snapshots = [entry["number"] for entry in history if entry["snapshot"]]
+        self.assertEqual(snapshots[:2], [1, 5])
+        self.assertIn(7, snapshots)
+        # Never more than SNAPSHOT_EVERY - 1 deltas to replay
+        for first, second in zip(snapshots, snapshots[1:] + [len(versions) + 1]):
+            self.assertLessEqual(second - first, 4)
+        self.assertLess(os.path.getsize(revisions._path("Historia")), sum(map(len, versions)) / 3)
+
+        # From the cached index and from a new process
+        for _ in range(2):
+            for number, content in enumerate(versions, 1):
+                self.assertEqual(revisions.get("Historia", number), content)
+            revisions._indexes.clear()
+        self.assertIsNone(revisions.get("Historia", 0))
+        self.assertIsNone(revisions.get("Historia", len(versions) + 1))
+        lines = revisions.diff("Historia", 1, 2)
+        self.assertIn("+Nueva línea ✓", lines)
+
+    def test_truncated_tail_is_ignored_and_overwritten(self):
+        versions = self.versions()[:3]
+        for content in versions:
+            revisions.record("Cortada", content)
+        path = revisions._path("Cortada")
+        size = os.path.getsize(path)
+        revisions.record("Cortada", "Versión que no llegó a escribirse entera.\n" * 20)
+        # Crash halfway through the last append
+        with open(path, "r+b") as f:
+            f.truncate(size + (os.path.getsize(path) - size) // 2)
+        revisions._indexes.clear()
+
+        self.assertEqual(revisions.count("Cortada"), 3)
+        self.assertEqual(revisions.get("Cortada", 3), versions[2])
+        self.assertEqual(revisions.record("Cortada", "Después del fallo.\n"), 4)
+        revisions._indexes.clear()
+        self.assertEqual([revisions.get("Cortada", number) for number in range(1, 5)],
+                         versions + ["Después del fallo.\n"])
+
+    def test_corrupt_tail(self):
+        versions = self.versions()[:3]
+        for content in versions:
+            revisions.record("Dañada", content)
+        path = revisions._path("Dañada")
+        with open(path, "ab") as f:
+            f.write(b"\xff" * (revisions.HEADER.size + 10))
+        self.assertEqual(revisions.count("Dañada"), 3)
+
+        # A complete record whose payload is not zlib data
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - revisions.HEADER.size - 10)
+            f.seek(0, os.SEEK_END)
+            f.write(revisions.HEADER.pack(revisions.DELTA, 0, 5, 5) + b"nope!")
+        self.assertEqual(revisions.count("Dañada"), 4)
+        self.assertIsNone(revisions.get("Dañada", 4))
+        self.assertEqual(revisions.get("Dañada", 3), versions[2])
+        # The next version is stored whole, so it does not depend on it
+        self.assertEqual(revisions.record("Dañada", "Reparada.\n"), 5)
+        self.assertEqual(revisions.get("Dañada", 5), "Reparada.\n")
+
+    def test_revision_page_revalidates_when_a_revision_is_added(self):
+        revisions.record("Navegable", "Uno.\n")
+        url = reverse("revision", args=["Navegable", 1])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        revisions.record("Navegable", "Dos.\n")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(reverse("revision", args=["Navegable", 2]), response.content.decode())
+
+    def test_history_link_only_with_revisions(self):
+        self.write_entry("Python", "Primera.\n")
+        url = reverse("wiki", args=["Python"])
+        link = f'href="{reverse("history", args=["Python"])}"'
+
+        def pages():
+            request = RequestFactory().get(url)
+            return [self.client.get(url).content.decode(),
+                    asyncio.run(async_views.wiki(request, "Python")).content.decode()]
+
+        with override_settings(WIKI_REVISIONS=False):
+            for page in pages():
+                self.assertNotIn(link, page)
+        for page in pages():
+            self.assertIn(link, page)
+        # Saved with history on: still linked once it is turned off
+        util.save_entry("Python", "Segunda.\n")
+        util.get_entry_html("Python")
+        with override_settings(WIKI_REVISIONS=False):
+            for page in pages():
+                self.assertIn(link, page)
+
+
+LONG_ENTRY = "Introducción con [un enlace](/wiki/Corta).\n\n" + "".join(
+    f"{'#' if number % 3 == 0 else '##'} Sección {number}\n\n"
+    f"Párrafo **{number}** con `código`.\n\n"
+    "```\n# comentario, no un título\n```\n\n"
+    f"- punto {number}\n- otro\n\n"
+    for number in range(10))
+
+
+class SectionTests(SimpleTestCase):
+
+    def test_split_at_headings_outside_code(self):
+        sections = render.split_sections(LONG_ENTRY)
+        self.assertEqual(len(sections), 11)
+        self.assertEqual(sections[0][:2], (0, None))
+        self.assertEqual([section[:2] for section in sections[1:4]],
+                         [(1, "Sección 0"), (2, "Sección 1"), (2, "Sección 2")])
+        self.assertEqual("".join(source for _, _, source in sections), LONG_ENTRY)
+
+        sections = render.split_sections("# Título con [enlace](/wiki/X) y *énfasis* #\n\n### Tres\n\nTexto\n")
+        self.assertEqual([section[:2] for section in sections], [(1, "Título con enlace y énfasis")])
+
+    def test_declines_document_wide_definitions(self):
+        for definition in ("[ref]: /wiki/Otra", "[^1]: Nota al pie.", "*[HTML]: HyperText Markup Language"):
+            content = LONG_ENTRY + f"\n{definition}\n"
+            self.assertIsNone(render.split_sections(content))
+            self.assertIsNone(util._split(content))
+        self.assertIsNone(util._split("# Una\n\n# Dos\n"))
+
+    def test_sections_render_like_the_whole_entry(self):
+        sections = util._split(LONG_ENTRY)
+        self.assertIsNotNone(sections)
+        self.assertEqual("\n".join(util.render_sections(sections)), render.render(LONG_ENTRY))
+        self.assertEqual(util._render_entry(LONG_ENTRY), render.render(LONG_ENTRY))
+
+
+class WikiConditionalGetTests(TempMediaMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_entry("Corta", "# Corta\n\nPocas líneas.\n")
+        self.write_entry("Larga", LONG_ENTRY)
+        self.urls = [reverse("wiki", args=["Corta"]), reverse("wiki", args=["Corta"]) + "?full=1",
+                     reverse("wiki", args=["Larga"]), reverse("wiki", args=["Larga"]) + "?full=1"]
+
+    def test_sync_views(self):
+        etags = set()
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            etags.add(response["ETag"])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304, url)
+        self.assertEqual(len(etags), len(self.urls))
+
+    def test_async_views(self):
+        factory = RequestFactory()
+        for url in self.urls:
+            title = url.split("/")[2]
+            response = asyncio.run(async_views.wiki(factory.get(url), title))
+            self.assertEqual(response.status_code, 200, url)
+            request = factory.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(asyncio.run(async_views.wiki(request, title)).status_code, 304, url)
+            # Same tags as the sync views
+            self.assertEqual(self.client.get(url)["ETag"], response["ETag"])
+
+    def test_section_pages(self):
+        response = self.client.get(reverse("wiki", args=["Larga"]))
+        page = response.content.decode()
+        self.assertIn('class="toc"', page)
+        digest = util.entry_hash("Larga")
+        sections = []
+        for index in range(11):
+            url = reverse("wiki_section", args=["Larga", index]) + f"?v={digest[:12]}"
+            # The first screen comes with the page, the rest is loaded later
+            self.assertEqual(url in page, index >= settings.WIKI_SECTIONS_FIRST_SCREEN)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(f"max-age={settings.WIKI_CACHE_MAX_AGE['revision']}", response["Cache-Control"])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+            sections.append(response.content.decode())
+        self.assertEqual("\n".join(sections), util.get_entry_html("Larga"))
+        self.assertEqual(self.client.get(reverse("wiki_section", args=["Larga", 11])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("wiki_section", args=["Corta", 0])).status_code, 404)
+
+
+@override_settings(WIKI_REVISIONS=False)
+class IndexSearchConditionalGetTests(TempMediaMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        search._store.reset()
+        self.addCleanup(search._store.reset)
+        self.write_entry("Python", "Un lenguaje.\n")
+        util.save_data("Python", "Lenguaje", "Ana")
+
+    def assertRevalidates(self, url, change, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304, url)
+        change()
+        # Caches holding the old page get the new one on their next check
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200, url)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        self.assertIn(expected, body.decode())
+
+    def add_entry(self):
+        # What newpage does
+        util.save_entry("Django", "Un framework.\n")
+        util.save_data("Django", "Web", "Luis")
+
+    def test_index_pages(self):
+        self.assertRevalidates(reverse("index"), self.add_entry, "Django")
+
+    def test_index_all(self):
+        self.assertRevalidates(reverse("index_all"), self.add_entry, "Django")
+
+    def test_search(self):
+        url = reverse("search") + "?q=lenguaje"
+        self.assertRevalidates(url, lambda: util.save_entry("Python", "Un lenguaje de programación.\n"), "Python")
+
+    def test_wiki_page_after_edit(self):
+        def edit():
+            # What edit_entry does before redirecting the editor to the page
+            util.save_entry("Python", "Un lenguaje, editado.\n")
+            util.get_entry_html("Python")
+        self.assertRevalidates(reverse("wiki", args=["Python"]), edit, "editado")
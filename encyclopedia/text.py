@@ -0,0 +1,120 @@
+"""
+Text normalization and fuzzy title matching helpers.
+
+This module has no Django dependencies so the static builder can share it.
+"""
+import html
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from urllib.parse import unquote, urlsplit
+
+_TOKEN_RE = re.compile(r"\w+")
+_HREF_RE = re.compile(r"""href\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+# Link targets in Markdown source: [text](url), [id]: url definitions and
+# raw HTML href attributes. Images (![alt](url)) are matched to be skipped
+_MARKDOWN_LINK_RE = re.compile(
+    r"""(!?)\[(?:[^\[\]\n]|\[[^\]\n]*\])*\]\(\s*<?([^\s)>]+)"""
+    r"""|^ {0,3}\[[^\]\n]+\]:[ \t]*<?([^\s>]+)"""
+    r"""|href\s*=\s*(?:"([^"]*)"|'([^']*)')""",
+    re.IGNORECASE | re.MULTILINE)
+# Fenced blocks and code spans, whose contents are not links
+_CODE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,}).*?(?:^ {0,3}\1[`~]*[ \t]*$|\Z)|(`+).+?\2", re.MULTILINE | re.DOTALL)
+WIKI_PREFIX = "/wiki/"
+
+# Titles sharing the most trigrams with the query are re-scored exactly
+FUZZY_CANDIDATES = 64
+
+
+def normalize(text):
+    """
+    Casefolds text and strips accents, so "Creación" becomes "creacion".
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    """
+    Splits text into normalized search terms.
+    """
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _link_title(href):
+    url = urlsplit(html.unescape(href))
+    # Site-relative links only; other sites may have a /wiki/ too
+    if not url.netloc and url.path.startswith(WIKI_PREFIX):
+        return unquote(url.path[len(WIKI_PREFIX):]).strip("/")
+    return ""
+
+
+def _unique_titles(hrefs):
+    titles = {}
+    for href in hrefs:
+        title = _link_title(href)
+        if title:
+            titles.setdefault(title, None)
+    return list(titles)
+
+
+def extract_links(page):
+    """
+    Returns the entry titles an HTML page links to through /wiki/<title>
+    URLs, without duplicates, in order of first appearance.
+    """
+    return _unique_titles(double or single for double, single in _HREF_RE.findall(page))
+
+
+def extract_markdown_links(content):
+    """
+    Like extract_links(), but reading the Markdown source, so the links of
+    an entry are known without rendering it.
+    """
+    content = _CODE_RE.sub("", content)
+    return _unique_titles(inline or definition or double or single
+                          for image, inline, definition, double, single in _MARKDOWN_LINK_RE.findall(content)
+                          if not image)
+
+
+def trigrams(text):
+    """
+    Returns the set of character trigrams of an already normalized string,
+    padded so that short words still produce some.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Typo-tolerant title lookup. A trigram -> titles map yields a small
+    candidate set, which is then scored with SequenceMatcher.
+    """
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        self.keys = [normalize(title) for title in self.titles]
+        self.grams = {}
+        for position, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, []).append(position)
+
+    def search(self, reference, threshold=0.3):
+        """
+        Returns the titles whose similarity ratio with reference is at least
+        threshold, most similar first.
+        """
+        key = normalize(reference).strip()
+        if not key:
+            return []
+        shared = Counter()
+        for gram in trigrams(key):
+            shared.update(self.grams.get(gram, ()))
+        scored = []
+        for position, _ in shared.most_common(FUZZY_CANDIDATES):
+            ratio = SequenceMatcher(None, self.keys[position], key).ratio()
+            if ratio >= threshold:
+                scored.append((-ratio, self.titles[position]))
+        return [title for _, title in sorted(scored)]
@@ -1,12 +1,27 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import instrumentation
+
+# Same URLs, async implementations when served over ASGI
+if settings.WIKI_ASYNC_VIEWS:
+    from . import async_views as views
+else:
+    from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("all/", views.index_all, name="index_all"),
     path('wiki/<str:title>/', views.wiki, name="wiki"),
+    path("wiki/<str:title>/section/<int:index>/", views.wiki_section, name="wiki_section"),
     path("search/", views.search, name="search"),
     path("newpage/", views.newpage, name="newpage"),
     path("edit_entry/<path:title>/", views.edit_entry, name="edit_entry"),
     path("randpage/", views.randpage, name="randpage"),
+    path("backlinks/<str:title>/", views.backlinks, name="backlinks"),
+    path("links/broken/", views.broken_links, name="broken_links"),
+    path("history/<str:title>/", views.history, name="history"),
+    path("history/<str:title>/<int:number>/", views.revision, name="revision"),
+    path("diff/<str:title>/", views.diff, name="diff"),
+    path("metrics/", instrumentation.metrics, name="metrics"),
 ]
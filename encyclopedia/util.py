@@ -1,156 +1,605 @@
-import re
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-import json
+from django.conf import settings
+from django.core.cache import caches
+import asyncio
+import contextvars
+import functools
 import os
+import bisect
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from PIL import Image
-import os
-from difflib import SequenceMatcher
+from . import images, render, revisions
+from .instrumentation import stage, timed
+from .signals import entry_deleted, entry_saved
+from .storage import FilesystemBackend, get_backend
+from .text import TrigramIndex
+
+# Rendered HTML cache: (title, content hash) -> sanitized HTML, oldest first
+_html_cache = OrderedDict()
+_html_cache_lock = threading.Lock()
+
+# Renders in progress: (title, content hash) -> Future shared by every
+# request waiting for that page
+_renders = {}
+
+# Content hash of the newest rendering of each entry in _html_cache:
+# title -> content hash. When the entry changes (in any process), that
+# rendering is served while the new version renders (stale-while-revalidate)
+_latest_html = {}
+
+# Renderings dropped by invalidate_entry_html(keep_stale=True), served the
+# same way: title -> (content hash, html). An entry saved but not read again
+# keeps its one until evicted (LRU, at most WIKI_HTML_CACHE_SIZE)
+_stale_html = OrderedDict()
+
+# Long entries are rendered by section: section source hash -> sanitized
+# HTML, so an edit only re-renders the sections it touched
+_section_html = OrderedDict()
+# Section layout of long entries: (title, content hash) -> [section dicts]
+_layouts = OrderedDict()
+_sections_lock = threading.Lock()
+
+# Bounded pool for CPU-bound rendering requested from async views
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+# Content hash per entry: title -> ((mtime, size) it was computed at, sha1)
+_entry_hashes = {}
+
+# Trigram index over the last title list passed to match(umb=...)
+_trigram_index = {"titles": None, "index": None}
+_trigram_lock = threading.Lock()
+
+# Shared counter in the fragments cache, moved on by every catalog change
+CATALOG_VERSION_KEY = "catalog-version"
+
+# Title tuple for random_entry(), valid while the catalog stamp is unchanged
+_random_titles = {"stamp": False, "titles": ()}
+_random_lock = threading.Lock()
 
 def list_entries():
     """
     Returns a list of all names of encyclopedia entries.
     """
-    _, filenames = default_storage.listdir("entries")
-    return list(sorted(re.sub(r"\.md$", "", filename)
-                for filename in filenames if filename.endswith(".md")))
+    return get_backend().list_entries()
 
 
+def random_entry():
+    """
+    Returns the title of a random entry, or None if there are none.
+    The title list is only rebuilt when the catalog stamp changes, so a
+    pick costs one stat instead of a directory listing.
+    """
+    stamp = get_backend().catalog_stamp()
+    with _random_lock:
+        if stamp != _random_titles["stamp"]:
+            _random_titles["titles"] = tuple(list_entries())
+            _random_titles["stamp"] = stamp
+        titles = _random_titles["titles"]
+    return random.choice(titles) if titles else None
+
+
+@timed("storage.write")
 def save_entry(title, content):
     """
     Saves an encyclopedia entry, given its title and Markdown
     content. If an existing entry with the same title already exists,
-    it is replaced.
+    it is replaced atomically.
+    """
+    # Ensure we store text decoded as UTF-8 to avoid corruption of accents/emojis
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    backend = get_backend()
+    if revisions.enabled() and not revisions.count(title):
+        # First save with history on: keep the version about to be replaced
+        previous = backend.get_entry(title)
+        if previous is not None:
+            stamp = backend.entry_stamp(title)
+            revisions.record(title, previous, timestamp=stamp[0] / 1e9 if stamp else None)
+    backend.save_entry(title, content)
+    if revisions.enabled():
+        revisions.record(title, content)
+    _entry_hashes.pop(title, None)
+    invalidate_entry_html(title, keep_stale=True)
+    bump_catalog()
+    entry_saved.send(sender=None, title=title, content=content)
+
+
+def delete_entry(title):
+    """
+    Removes an encyclopedia entry, if it exists.
+    """
+    get_backend().delete_entry(title)
+    _entry_hashes.pop(title, None)
+    invalidate_entry_html(title)
+    bump_catalog()
+    entry_deleted.send(sender=None, title=title)
+
+
+def entry_stamp(title):
+    """
+    Returns a cheap version stamp of an entry, (mtime in ns, size), or None
+    if no such entry exists.
+    """
+    return get_backend().entry_stamp(title)
+
+
+def _content_hash(content):
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def _entry_version(title):
+    """
+    Returns (content hash, content) for an entry, or (None, None). The hash
+    is remembered per (mtime, size) stamp, so while the file is unchanged
+    only a stat is needed and content comes back as None.
+    """
+    stamp = entry_stamp(title)
+    if stamp is None:
+        return None, None
+    cached = _entry_hashes.get(title)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], None
+    content = get_entry(title)
+    if content is None:
+        return None, None
+    digest = _content_hash(content)
+    _entry_hashes[title] = (stamp, digest)
+    return digest, content
+
+
+def entry_hash(title):
+    """
+    Returns the SHA-1 of an entry's content, or None if no such entry exists.
+    """
+    return _entry_version(title)[0]
+
+
+def fragment_cache():
+    """
+    Returns the cache shared by every worker process ("fragments" in CACHES).
+    """
+    return caches["fragments"]
+
+
+def bump_catalog():
+    """
+    Moves the shared catalog version on, so no process keeps using card
+    grids rendered before a change to the entries, metadata or images.
+    """
+    cache = fragment_cache()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # Missing (first change, or culled): any value not used lately will do
+        cache.set(CATALOG_VERSION_KEY, random.getrandbits(32), timeout=None)
+
+
+def catalog_version():
+    """
+    Returns a version string for everything the card grid depends on: the
+    set of entries, the metadata file and the card images. Costs a few stats
+    and a read of the shared counter bumped by bump_catalog(); the stats
+    also catch changes made outside the app (e.g. an edited wikis.json).
     """
-    filename = f"entries/{title}.md"
-    if default_storage.exists(filename):
-        default_storage.delete(filename)
-    # Ensure we write UTF-8 bytes to avoid corruption of accents/emojis
-    if isinstance(content, str):
-        content_bytes = content.encode("utf-8")
-    else:
-        content_bytes = content
-    default_storage.save(filename, ContentFile(content_bytes))
+    backend = get_backend()
+    parts = (fragment_cache().get(CATALOG_VERSION_KEY), backend.catalog_stamp(),
+             backend.meta_stamp(), images.registry.version())
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
 
 
+@timed("storage.read")
 def get_entry(title):
     """
     Retrieves an encyclopedia entry by its title. If no such
     entry exists, the function returns None.
     """
+    return get_backend().get_entry(title)
+
+def render_markdown(content):
+    """
+    Converts Markdown content to sanitized HTML.
+    """
+    return render.render(content, stage)
+
+
+def render_markdown_many(contents):
+    """
+    Converts several Markdown documents to sanitized HTML, in order.
+    """
+    return render.render_many(contents, stage)
+
+
+def get_entry_html(title):
+    """
+    Retrieves an encyclopedia entry rendered as sanitized HTML. If no such
+    entry exists, the function returns None. Rendered pages are cached by
+    title and content hash, so an edited file is never served stale; the
+    least recently used pages are evicted once WIKI_HTML_CACHE_SIZE is reached.
+    Concurrent requests for a page that is not cached yet share one render.
+    """
+    return _rendering(title, stale=False)[1]
+
+
+def get_entry_rendering(title):
+    """
+    Like get_entry_html(), but returns (content hash, html), the hash being
+    the one of the content that was rendered, or (None, None). Readers of
+    an entry changed since this process last rendered it never wait for
+    the re-render: it runs on the render executor while they get the
+    previous HTML.
+    """
+    return _rendering(title, stale=True)
+
+
+def _rendering(title, stale):
+    digest, html, content = _lookup(title)
+    if content is None:
+        return digest, html
+    key, future, owner, previous = _claim(title, content, stale)
+    if previous is not None:
+        if owner:
+            _submit_render(key, future, content)
+        return previous
+    if owner:
+        _finish_render(key, future, content)
+    return key[1], future.result()
+
+
+def _lookup(title):
+    """
+    Returns (content hash, cached html, None) when the current version of
+    an entry is cached, (content hash, None, content) when it must be
+    rendered and (None, None, None) if no such entry exists. Blocking.
+    """
+    digest, content = _entry_version(title)
+    if digest is None:
+        return None, None, None
+    html = _cached_html((title, digest))
+    if html is not None:
+        return digest, html, None
+    if content is None:
+        content = get_entry(title)
+        if content is None:
+            return None, None, None
+    return digest, None, content
+
+
+def _claim(title, content, stale):
+    """
+    Returns (key, future, owner, previous) for rendering `content`: the
+    future completes with the HTML and must be completed by the caller if
+    owner is True. With `stale`, previous is the (content hash, html) of an
+    older rendering to serve meanwhile, if any.
+    """
+    # Key by what is actually rendered, in case the file changed meanwhile
+    key = (title, _content_hash(content))
+    future, owner = _claim_render(key)
+    return key, future, owner, _stale_rendering(key, future) if stale else None
+
+
+def _cached_html(key):
+    with _html_cache_lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+        return html
+
+
+def _claim_render(key):
+    """
+    Returns (future, owner): the in-flight render of `key`, which the caller
+    must complete with _finish_render() if owner is True.
+    """
+    with _html_cache_lock:
+        future = _renders.get(key)
+        if future is not None:
+            return future, False
+        future = Future()
+        html = _html_cache.get(key)
+        if html is not None:
+            # Finished between the cache check and now
+            future.set_result(html)
+            return future, False
+        _renders[key] = future
+        return future, True
+
+
+def _stale_rendering(key, future):
+    """
+    Returns the (content hash, html) of the entry's previous rendering held
+    by this process, or None. Any process that rendered the entry before
+    has one, not only the one where it was saved.
+    """
+    title, digest = key
+    with _html_cache_lock:
+        if future.done():
+            return None
+        previous = _stale_html.get(title)
+        if previous is not None:
+            return previous
+        latest = _latest_html.get(title)
+        if latest is None or latest == digest:
+            return None
+        return latest, _html_cache[(title, latest)]
+
+
+def _submit_render(key, future, content):
+    render_executor().submit(contextvars.copy_context().run, _finish_render, key, future, content)
+
+
+def _finish_render(key, future, content):
     try:
-        f = default_storage.open(f"entries/{title}.md", "rb")
-        raw = f.read()
-        if isinstance(raw, bytes):
-            return raw.decode("utf-8")
-        return raw
-    except FileNotFoundError:
+        html = _render_entry(content)
+    except Exception as exc:
+        with _html_cache_lock:
+            _renders.pop(key, None)
+        future.set_exception(exc)
+        return
+    title, digest = key
+    max_size = getattr(settings, "WIKI_HTML_CACHE_SIZE", 256)
+    with _html_cache_lock:
+        # The previous version is no longer needed, not even as a fallback
+        previous = _latest_html.get(title)
+        if previous is not None and previous != digest:
+            _html_cache.pop((title, previous), None)
+        _html_cache[key] = html
+        _html_cache.move_to_end(key)
+        _latest_html[title] = digest
+        while len(_html_cache) > max_size:
+            (evicted, evicted_digest), _ = _html_cache.popitem(last=False)
+            if _latest_html.get(evicted) == evicted_digest:
+                del _latest_html[evicted]
+        _renders.pop(key, None)
+        _stale_html.pop(title, None)
+    future.set_result(html)
+
+
+def invalidate_entry_html(title, keep_stale=False):
+    """
+    Drops every cached rendering of an entry. With keep_stale, the newest
+    one is kept aside for get_entry_rendering() to serve until the new
+    version is rendered.
+    """
+    with _html_cache_lock:
+        latest = _latest_html.pop(title, None)
+        if keep_stale and latest is not None:
+            _lru_put(_stale_html, title, (latest, _html_cache[(title, latest)]),
+                     getattr(settings, "WIKI_HTML_CACHE_SIZE", 256))
+        elif not keep_stale:
+            _stale_html.pop(title, None)
+        for key in [key for key in _html_cache if key[0] == title]:
+            del _html_cache[key]
+
+
+def _lru_put(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def _split(content):
+    """
+    Returns the sections of an entry long enough to be rendered (and
+    served) by section, as dicts with index, level, heading, hash and
+    source; None otherwise.
+    """
+    sections = render.split_sections(content)
+    if sections is None or len(sections) < getattr(settings, "WIKI_SECTIONS_MIN", 8):
         return None
+    return [{"index": index, "level": level, "heading": heading, "source": source,
+             "hash": _content_hash(source)}
+            for index, (level, heading, source) in enumerate(sections)]
 
-def save_data(title, category, author):
-    dir_path = 'datas'
-    if not default_storage.exists(dir_path):
-        os.makedirs(os.path.join(default_storage.location, dir_path), exist_ok=True)
-    file_path = f"{dir_path}/wikis.json"
-    data = []
-    if default_storage.exists(file_path):
-        # Read file as bytes and decode using utf-8 to preserve special chars
-        with default_storage.open(file_path, 'rb') as f:
-            try:
-                raw = f.read()
-                if isinstance(raw, bytes):
-                    data = json.loads(raw.decode('utf-8'))
-                else:
-                    data = json.load(f)
-            except Exception:
-                data = []
-    # Prevent duplicate metadata entries by title (case-insensitive)
-    normalized_title = title.strip().lower()
-    for entry in data:
-        if entry.get('title', '').strip().lower() == normalized_title:
-            # Duplicate found; don't add
-            return False
 
-    new_entry = {
+def render_sections(sections):
+    """
+    Returns the HTML of each section, rendering only those not cached
+    (in one batch).
+    """
+    with _sections_lock:
+        found = {section["hash"]: _section_html.get(section["hash"]) for section in sections}
+        for digest, html in found.items():
+            if html is not None:
+                _section_html.move_to_end(digest)
+    missing = {section["hash"]: section["source"] for section in sections if found[section["hash"]] is None}
+    if missing:
+        with stage("sections"):
+            rendered = render.render_many(list(missing.values()), stage)
+        max_size = getattr(settings, "WIKI_SECTION_CACHE_SIZE", 4096)
+        with _sections_lock:
+            for digest, html in zip(missing, rendered):
+                found[digest] = html
+                _lru_put(_section_html, digest, html, max_size)
+    return [found[section["hash"]] for section in sections]
+
+
+def _render_entry(content):
+    # Long entries are assembled from their (cached) sections
+    sections = _split(content)
+    if sections is None:
+        return render_markdown(content)
+    return "\n".join(render_sections(sections))
+
+
+def get_entry_sections(title):
+    """
+    Returns (content hash, sections) for an entry: sections is the list
+    from _split() for long entries and None for the others. Returns
+    (None, None) if no such entry exists.
+    """
+    digest, content = _entry_version(title)
+    if digest is None:
+        return None, None
+    with _sections_lock:
+        if (title, digest) in _layouts:
+            _layouts.move_to_end((title, digest))
+            return digest, _layouts[(title, digest)]
+    if content is None:
+        content = get_entry(title)
+        if content is None:
+            return None, None
+        digest = _content_hash(content)
+    sections = _split(content)
+    with _sections_lock:
+        _lru_put(_layouts, (title, digest), sections, getattr(settings, "WIKI_HTML_CACHE_SIZE", 256))
+    return digest, sections
+
+
+@timed("metadata")
+def get_meta(title):
+    """
+    Returns the metadata record for a title (case-insensitive), or None.
+    """
+    return get_backend().get_meta(title)
+
+
+@timed("metadata.write")
+def save_data_many(records):
+    """
+    Stores the metadata of many new entries in a single write. Returns the
+    titles stored; titles that already have metadata are skipped.
+    """
+    added = get_backend().add_metas(records)
+    if added:
+        bump_catalog()
+    return added
+
+
+@timed("metadata.write")
+def save_data(title, category, author):
+    """
+    Stores the metadata of a new entry. Returns False, storing nothing, if
+    the title (case-insensitive) already has metadata.
+    """
+    saved = get_backend().add_meta({
         "title": title,
         "category": category,
         "author": author,
-    }
-    data.append(new_entry)
-    # Write JSON using utf-8 bytes so special characters are preserved
-    content_bytes = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
-    content_file = ContentFile(content_bytes)
-    if default_storage.exists(file_path):
-        default_storage.delete(file_path)
-    default_storage.save(file_path, content_file)
-    return True
-    
-    
+    })
+    if saved:
+        bump_catalog()
+    return saved
+
+
+def update_data(title, **fields):
+    """
+    Updates fields of an existing metadata record (e.g. its image variants).
+    Returns False if the title has no metadata.
+    """
+    updated = get_backend().update_meta(title, fields)
+    if updated:
+        bump_catalog()
+    return updated
+
+
+@timed("metadata")
 def get_entries_meta(titles):
-    file_path = "datas/wikis.json"
+    return _cards(titles, get_backend().get_metas(titles))
+
+
+def _cards(titles, found):
     results = []
-    if default_storage.exists(file_path):
-        with default_storage.open(file_path, "rb") as f:
-            try:
-                raw = f.read()
-                if isinstance(raw, bytes):
-                    data = json.loads(raw.decode('utf-8'))
-                else:
-                    data = json.load(f)
-            except Exception:
-                data = []
-        for title in titles:
-            for entry in data:
-                if entry.get("title", "").lower() == title.lower():
-                    image_url = get_image(title)
-                    results.append({
-                        "title": entry.get("title"),
-                        "category": entry.get("category"),
-                        "author": entry.get("author"),
-                        "image_url": image_url
-                    })
+    registry = images.registry.refresh()
+    for title in titles:
+        entry = found.get(title)
+        if entry is not None:
+            results.append({
+                "title": entry.get("title"),
+                "category": entry.get("category"),
+                "author": entry.get("author"),
+                "image_url": registry.card_url(title),
+                "image_set": registry.image_set(title),
+            })
     return results
-    
+
+
+def _meta_matches(entry, category, author):
+    for field, wanted in (("category", category), ("author", author)):
+        if wanted and (entry.get(field) or "").strip().casefold() != wanted.strip().casefold():
+            return False
+    return True
+
+
+@timed("metadata")
+def page_entries(after=None, limit=48, category=None, author=None):
+    """
+    Returns (cards, next cursor) for up to `limit` entries in title order,
+    starting right after the title `after`. `category` and `author` filter
+    case-insensitively. The cursor is the last title of the page, or None on
+    the last page; only the metadata of the titles scanned is loaded.
+    """
+    titles = list_entries()
+    position = bisect.bisect_right(titles, after) if after else 0
+    batch_size = max(limit, 64)
+    page, found = [], {}
+    while position < len(titles) and len(page) <= limit:
+        batch = titles[position:position + batch_size]
+        position += len(batch)
+        metas = get_backend().get_metas(batch)
+        for title in batch:
+            entry = metas.get(title)
+            if entry is None or not _meta_matches(entry, category, author):
+                continue
+            page.append(title)
+            found[title] = entry
+            # One extra title tells whether there is a next page
+            if len(page) > limit:
+                break
+    next_cursor = page[limit - 1] if len(page) > limit else None
+    return _cards(page[:limit], found), next_cursor
+
+
 def convert_to_webp(title):
     image_dir = "encyclopedia/static/images"
     for ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
         img_path = os.path.join(image_dir, f"{title}{ext}")
         if os.path.exists(img_path):
-            img = Image.open(img_path)
-            webp_path = os.path.join(image_dir, f"{title}.webp")
-            img.save(webp_path, "WEBP")
+            with Image.open(img_path) as img:
+                webp_path = os.path.join(image_dir, f"{title}.webp")
+                img.save(webp_path, "WEBP")
             os.remove(img_path)
+            images.registry.invalidate()
+            bump_catalog()
             return webp_path
     return None
 
 def get_image(title):
-    image_dir = "encyclopedia/static/images"
-    webp_path = os.path.join(image_dir, f"{title}.webp")
-    if os.path.exists(webp_path):
-        return f"/static/images/{title}.webp"
-    for ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-        img_path = os.path.join(image_dir, f"{title}{ext}")
-        if os.path.exists(img_path):
-            return f"/static/images/{title}{ext}"
-    return None
+    """
+    Returns the URL of the image shown on an entry's card: the smallest
+    resized variant that fills a card, else the original upload.
+    """
+    return images.registry.refresh().card_url(title)
 
 
-"""Con coincidencias"""    
-"""
-def match(lista, reference, umb=0.3):
-    coincidence = []
-    for palabra in lista:
-        ratio = SequenceMatcher(None, palabra, reference).ratio()
-        if ratio>=umb:
-            coincidence.append((palabra))
-    return coincidence
+"""Con coincidencias"""
+
+
+def _fuzzy_index(lista):
+    titles = tuple(lista)
+    with _trigram_lock:
+        if _trigram_index["titles"] != titles:
+            _trigram_index.update(titles=titles, index=TrigramIndex(titles))
+        return _trigram_index["index"]
 
-"""
 
 """Con subcadenas"""
 
 
-def match(lista, reference):
+@timed("match")
+def match(lista, reference, umb=None):
+    """
+    Returns the titles in lista that contain reference (case-insensitive).
+    When a threshold umb is given, titles are matched fuzzily instead:
+    those whose similarity with reference is at least umb, best first.
+    """
+    if umb is not None:
+        return _fuzzy_index(lista).search(reference, umb)
     coincidence = []
     ref = reference.lower()
     for palabra in lista:
@@ -158,3 +607,73 @@ def match(lista, reference):
             coincidence.append(palabra)
     return coincidence
 
+
+# Async API, for the ASGI views (async_views.py). Storage calls block, so they
+# run in worker threads; rendering runs on a bounded executor so a burst of
+# uncached pages cannot take every thread.
+
+def offload(func):
+    """
+    Wraps a blocking function into a coroutine function run in a worker thread.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Database backends stay on Django's thread-sensitive executor, which
+        # manages their connections; plain files can use any thread
+        sensitive = not isinstance(get_backend(), FilesystemBackend)
+        return await sync_to_async(func, thread_sensitive=sensitive)(*args, **kwargs)
+    return wrapper
+
+
+arandom_entry = offload(random_entry)
+aget_entry_sections = offload(get_entry_sections)
+
+
+def render_executor():
+    """
+    Returns the process-wide pool (WIKI_RENDER_WORKERS threads) for rendering.
+    """
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            workers = getattr(settings, "WIKI_RENDER_WORKERS", 0) or min(4, os.cpu_count() or 1)
+            _render_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        return _render_executor
+
+
+async def run_rendering(func, *args):
+    """
+    Runs a CPU-bound function on the render executor (keeping the context,
+    e.g. instrumentation timings) and returns its result.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        render_executor(), functools.partial(context.run, func, *args))
+
+
+async def aget_entry_html(title):
+    """
+    Async get_entry_html(): identical concurrent requests await one render.
+    """
+    return (await _arendering(title, stale=False))[1]
+
+
+async def aget_entry_rendering(title):
+    """
+    Async get_entry_rendering(): serves the previous HTML of a changed entry
+    while it re-renders, otherwise awaits the (shared) render.
+    """
+    return await _arendering(title, stale=True)
+
+
+async def _arendering(title, stale):
+    digest, html, content = await offload(_lookup)(title)
+    if content is None:
+        return digest, html
+    key, future, owner, previous = _claim(title, content, stale)
+    if owner:
+        _submit_render(key, future, content)
+    if previous is not None:
+        return previous
+    # Shielded: a client going away must not cancel the render others await
+    return key[1], await asyncio.shield(asyncio.wrap_future(future))
@@ -1,74 +1,382 @@
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django import shortcuts
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.utils.safestring import mark_safe
 from django.core.files.storage import default_storage
-from . import util
-import markdown
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from . import images, links, revisions, util
+import hashlib
 import os
-import random
 from .forms import NewWiki
-import bleach
-
-# Bleach policy: allow class attribute so users can use CSS classes defined in site CSS
-ALLOWED_TAGS = [
-    'p','br','ul','ol','li','strong','em','a','img','h1','h2','h3','pre','code','blockquote',
-    # table-related tags
-    'table','thead','tbody','tr','th','td'
-]
-ALLOWED_ATTRS = {
-    'a': ['href', 'title', 'rel'],
-    'img': ['src', 'alt', 'title'],
-    # allow certain table attributes that are commonly used
-    'th': ['colspan', 'rowspan', 'scope', 'class'],
-    'td': ['colspan', 'rowspan', 'class'],
-    '*': ['class']
-}
+from .instrumentation import timed
+from .search import search_entries
 
+# Template rendering shows up as the "template" stage when instrumented
+render = timed("template")(shortcuts.render)
+
+# Minimum similarity for a typo-tolerant title match in search
+FUZZY_THRESHOLD = 0.6
+
+# Where index.html leaves room for the streamed cards
+STREAM_MARKER = "<!--cards-->"
+
+# Bump when templates change, so cached pages stop matching their old ETags
+ETAG_VERSION = "6"
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr((ETAG_VERSION,) + parts).encode("utf-8")).hexdigest()
+
+
+def _stamp_datetime(stamp):
+    return datetime.fromtimestamp(stamp[0] / 1e9, tz=timezone.utc) if stamp else None
+
+
+def _has_history(title):
+    # Entries saved while WIKI_REVISIONS was on keep their history when it is off
+    return revisions.enabled() or revisions.count(title) > 0
+
+
+def _cacheable(kind):
+    """
+    Cache-Control for a view per WIKI_CACHE_MAX_AGE[kind]; 0 means the page
+    may be stored but must be revalidated before each use.
+    """
+    max_age = settings.WIKI_CACHE_MAX_AGE[kind]
+    if max_age:
+        return cache_control(public=True, max_age=max_age)
+    return cache_control(public=True, no_cache=True)
+
+
+# ETag / Last-Modified functions: they only stat files (and hash an entry the
+# first time it is seen), so a 304 never reads or renders Markdown.
+
+def _wiki_version_etag(request, title, digest):
+    """
+    ETag of a wiki page showing version `digest` of an entry. Used both to
+    answer conditional requests and to tag the response, so they match.
+    """
+    # The "Historial" link depends on WIKI_REVISIONS too
+    return _etag("wiki", title, digest, "full" in request.GET, revisions.enabled())
+
+
+def _wiki_etag(request, title):
+    digest = util.entry_hash(title)
+    return _wiki_version_etag(request, title, digest) if digest else None
+
+
+def _section_etag(request, title, index):
+    digest = util.entry_hash(title)
+    return _etag("section", title, digest, index) if digest else None
+
+
+def _wiki_last_modified(request, title):
+    return _stamp_datetime(util.entry_stamp(title))
+
+
+def _index_etag(request):
+    # Pages differ by path (paged or streamed), cursor and filters
+    return _etag("index", request.get_full_path(), util.catalog_version())
+
+
+def _search_etag(request):
+    query = request.GET.get("q", "")
+    return _etag("search", query, util.catalog_version(), util.entry_hash(query))
+
+
+@_cacheable("index")
+@condition(etag_func=_index_etag)
 def index(request):
-    entries = util.list_entries()
-    entries_meta = util.get_entries_meta(entries)
-    return render(request, "encyclopedia/index.html", {
-        "entries": entries_meta,
-        
-    })
+    return render(request, "encyclopedia/index.html", _index_context(request))
+
+
+def _index_context(request):
+    filters = _index_filters(request)
+    after = request.GET.get("after") or None
+    cards, next_cursor = _index_page(after, filters)
+    return {
+        "cards": cards,
+        "filters": filters,
+        "first_url": f"?{urlencode(filters)}" if after else None,
+        "next_url": f"?{urlencode({**filters, 'after': next_cursor})}" if next_cursor else None,
+    }
+
+
+def _index_filters(request):
+    return {field: request.GET[field].strip()
+            for field in ("category", "author") if request.GET.get(field, "").strip()}
+
+
+def _cached_cards(key_parts, build):
+    """
+    Returns build() -> (card grid HTML, extra) through the fragments cache
+    shared by every worker, under the current catalog version.
+    """
+    cache = util.fragment_cache()
+    key = "cards:" + _etag(util.catalog_version(), *key_parts)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value)
+    return mark_safe(value[0]), value[1]
+
+
+def _card_grid(entries_meta):
+    return render_to_string("encyclopedia/card_grid.html", {"entries": entries_meta})
+
+
+def _index_page(after, filters):
+    """
+    Returns (card grid HTML, next cursor) for one page of the index.
+    """
+    def build():
+        entries_meta, next_cursor = util.page_entries(after, settings.WIKI_INDEX_PAGE_SIZE, **filters)
+        return _card_grid(entries_meta), next_cursor
+    return _cached_cards(("index", after, sorted(filters.items()), settings.WIKI_INDEX_PAGE_SIZE), build)
+
+
+def _results_cards(titles):
+    """
+    Returns the card grid HTML for a list of search results.
+    """
+    digest = hashlib.sha1("\n".join(titles).encode("utf-8")).hexdigest()
+    return _cached_cards(("results", digest), lambda: (_card_grid(util.get_entries_meta(titles)), None))[0]
+
+
+@_cacheable("index")
+@condition(etag_func=_index_etag)
+def index_all(request):
+    """
+    Every card on one page, streamed one batch at a time so the first cards
+    reach the browser before the rest are rendered.
+    """
+    filters = _index_filters(request)
+    page = render_to_string("encyclopedia/index.html", {
+        "stream": True, "stream_marker": STREAM_MARKER, "filters": filters}, request)
+    head, tail = page.split(STREAM_MARKER, 1)
+
+    def cards():
+        yield head
+        cursor = None
+        while True:
+            cards, cursor = _index_page(cursor, filters)
+            yield cards
+            if cursor is None:
+                break
+        yield tail
+
+    return StreamingHttpResponse(cards())
     
+@_cacheable("wiki")
+@condition(etag_func=_wiki_etag)
 def wiki(request, title):
-    achive = util.get_entry(title)
-    if achive is None:
+    # Long entries: the first sections now, the others when scrolled to
+    if "full" not in request.GET:
+        digest, sections = util.get_entry_sections(title)
+        if sections is not None:
+            response = render(request, "encyclopedia/wiki.html", _sections_context(title, digest, sections))
+            return _tag_rendering(request, response, title, digest)
+
+    digest, content = util.get_entry_rendering(title)
+    if content is None:
         return render(request, "encyclopedia/wiki.html", {
             "title": title,
             "wikis": "Enciclopedia no encontrada :(..."
         })
 
-    # Convert markdown to HTML with 'extra' extension (tables, etc.) and sanitize
-    raw_html = markdown.markdown(achive, extensions=["extra", "fenced_code"]) 
-    content = bleach.clean(raw_html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
-    return render(request, "encyclopedia/wiki.html", {
+    response = render(request, "encyclopedia/wiki.html", {
         "title": title,
+        "history": _has_history(title),
         "wikis": mark_safe(content)
     })
+    return _tag_rendering(request, response, title, digest)
+
+
+def _sections_context(title, digest, sections):
+    first = settings.WIKI_SECTIONS_FIRST_SCREEN
+    rendered = util.render_sections(sections[:first])
+    # The version in the URL lets browsers cache sections for good
+    query = f"?v={digest[:12]}"
+    return {
+        "title": title,
+        "history": _has_history(title),
+        "toc": [section for section in sections if section["heading"]],
+        "sections": [{
+            "index": section["index"],
+            "level": section["level"],
+            "heading": section["heading"],
+            "html": mark_safe(rendered[section["index"]]) if section["index"] < first else None,
+            "url": reverse("wiki_section", args=[title, section["index"]]) + query,
+        } for section in sections],
+    }
+
+
+@condition(etag_func=_section_etag)
+def wiki_section(request, title, index):
+    """
+    HTML of one section of a long entry, loaded by the wiki page on demand.
+    """
+    digest, sections = util.get_entry_sections(title)
+    if sections is None or not 0 <= index < len(sections):
+        raise Http404
+    response = HttpResponse(util.render_sections([sections[index]])[0])
+    # A URL carrying the current version never changes; others must revalidate
+    current = request.GET.get("v") == digest[:12]
+    patch_cache_control(response, public=True,
+                        max_age=settings.WIKI_CACHE_MAX_AGE["revision"] if current else 0)
+    return response
+
+
+def _tag_rendering(request, response, title, digest):
+    # The previous version may be served while an edit renders: tag it with
+    # its own ETag, and have caches revalidate it instead of keeping it. Its
+    # date is unknown, so it gets no Last-Modified: the file's is the new
+    # version's, and If-Modified-Since would then keep the old page
+    response.headers["ETag"] = quote_etag(_wiki_version_etag(request, title, digest))
+    # Stat before hashing: a change in between only drops the header
+    modified = _wiki_last_modified(request, title)
+    if digest != util.entry_hash(title):
+        patch_cache_control(response, no_cache=True)
+    elif modified:
+        response.headers["Last-Modified"] = http_date(modified.timestamp())
+    return response
         
+@_cacheable("search")
+@condition(etag_func=_search_etag)
 def search(request):
     query = request.GET.get("q", "")
-    list_entries = util.list_entries()
-    results = util.match(list_entries, query)
-    
-    if util.get_entry(query) is not None:
-        raw_html = markdown.markdown(util.get_entry(query), extensions=["extra", "fenced_code"]) 
-        content = bleach.clean(raw_html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
+    content = util.get_entry_html(query)
+    if content is not None:
         return render(request, "encyclopedia/wiki.html", {
-            "wikis": mark_safe(content), "title": query
+            "wikis": mark_safe(content), "title": query, "history": _has_history(query)
         })  
-    elif len(results) == 0:
+
+    results = _search_results(query)
+    if len(results) == 0:
         return render(request, "encyclopedia/results.html", {
             "results": "No results :(..."
         }) 
     else:
-        entries_meta = util.get_entries_meta(results)
         return render(request, "encyclopedia/results.html", {
-            "entries": entries_meta,
-        
+            "cards": _results_cards(results),
     })
         
+def _search_results(query):
+    # Ranked full-text hits first, then partial title matches (e.g. "Djan")
+    # and finally titles that are close to the query despite typos; only the
+    # first WIKI_SEARCH_RESULTS, so common terms do not list the whole catalog
+    limit = settings.WIKI_SEARCH_RESULTS
+    results = search_entries(query, limit)
+    if len(results) == limit:
+        return results
+    entries = util.list_entries()
+    found = set(results)
+    for title in util.match(entries, query) + util.match(entries, query, umb=FUZZY_THRESHOLD):
+        if title not in found:
+            found.add(title)
+            results.append(title)
+    return results[:limit]
+
+
+def backlinks(request, title):
+    """
+    Entries linking to `title`, served from the link graph.
+    """
+    return render(request, "encyclopedia/backlinks.html", {
+        "title": title,
+        "exists": util.entry_stamp(title) is not None,
+        "sources": links.backlinks(title),
+    })
+
+
+def broken_links(request):
+    """
+    Links to entries that do not exist, with the entries containing them.
+    """
+    return render(request, "encyclopedia/broken_links.html", {
+        "broken": sorted(links.broken_links().items()),
+    })
+
+
+def history(request, title):
+    """
+    Saved revisions of an entry, newest first.
+    """
+    entries = revisions.history(title)
+    if not entries and util.entry_stamp(title) is None:
+        raise Http404
+    return render(request, "encyclopedia/history.html", {
+        "title": title,
+        "revisions": entries[::-1],
+    })
+
+
+def _revision_etag(request, title, number):
+    # The body never changes, but the navigation depends on the newest revision
+    total = revisions.count(title)
+    return _etag("revision", title, number, total) if 1 <= number <= total else None
+
+
+@_cacheable("wiki")
+@condition(etag_func=_revision_etag)
+def revision(request, title, number):
+    content = revisions.get(title, number)
+    if content is None:
+        raise Http404
+    total = revisions.count(title)
+    return render(request, "encyclopedia/revision.html", {
+        "title": title,
+        "number": number,
+        "latest": number == total,
+        "previous": number - 1 if number > 1 else None,
+        "next": number + 1 if number < total else None,
+        # Old versions are not worth a place in the HTML cache
+        "wikis": mark_safe(util.render_markdown(content)),
+    })
+
+
+def _revision_number(request, name, default):
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise Http404
+
+
+def diff(request, title):
+    """
+    Differences between revisions ?from= and ?to= (by default, the latest
+    revision and the one before it).
+    """
+    total = revisions.count(title)
+    new = _revision_number(request, "to", total)
+    old = _revision_number(request, "from", new - 1)
+    lines = revisions.diff(title, old, new)
+    if lines is None:
+        raise Http404
+    kinds = {"+": "added", "-": "removed", "@": "hunk"}
+    response = render(request, "encyclopedia/diff.html", {
+        "title": title,
+        "old": old,
+        "new": new,
+        "lines": [(kinds.get(line[:1], ""), line) for line in lines[2:]],
+    })
+    # Between fixed revisions it never changes; "latest changes" moves with every edit
+    patch_cache_control(response, public=True,
+                        max_age=settings.WIKI_CACHE_MAX_AGE["revision"] if "to" in request.GET else 0)
+    return response
+
+
 def newpage(request):
     if request.method == "POST":
         form = NewWiki(request.POST, request.FILES)
@@ -87,8 +395,7 @@ def newpage(request):
                 })
 
             # Check metadata duplicates (case-insensitive)
-            existing_meta = util.get_entries_meta([title])
-            if existing_meta:
+            if util.get_meta(title) is not None:
                 return render(request, "encyclopedia/newpage.html", {
                     "form": form,
                     "error": "Ya existe metadatos para una entrada con este titulo :(..."
@@ -100,15 +407,14 @@ def newpage(request):
                 image_ext = os.path.splitext(image.name)[1]
                 image_path = f"encyclopedia/static/images/{title}{image_ext}"
                 default_storage.save(image_path, image)
+                images.registry.invalidate()
 
             # Save entry content and metadata. If metadata saving fails, rollback saved files.
             util.save_entry(title, content)
             saved = util.save_data(title, category, author)
             if not saved:
-                # Rollback: delete the entry file and image if they were saved
-                entry_path = f"entries/{title}.md"
-                if default_storage.exists(entry_path):
-                    default_storage.delete(entry_path)
+                # Rollback: delete the entry and image if they were saved
+                util.delete_entry(title)
                 if image_path and default_storage.exists(image_path):
                     default_storage.delete(image_path)
                 return render(request, "encyclopedia/newpage.html", {
@@ -116,10 +422,14 @@ def newpage(request):
                     "error": "No se pudieron guardar los metadatos (posible duplicado)."
                 })
 
-            raw_html = markdown.markdown(content, extensions=["extra", "fenced_code"]) 
-            clean_html = bleach.clean(raw_html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
+            # Resized card variants are generated in the background
+            if image_path:
+                images.schedule_variants(title)
+
+            clean_html = util.get_entry_html(title)
             return render(request, "encyclopedia/wiki.html",{
                 "title": title,
+                "history": _has_history(title),
                 "wikis": mark_safe(clean_html)
             })
     else:
@@ -143,17 +453,18 @@ def edit_entry(request, title):
     else:
         new_content = request.POST.get("content")
         util.save_entry(title, new_content)
-        
+        # Render now, so the editor is redirected to the new version; other
+        # readers keep getting the previous one until this finishes
+        util.get_entry_html(title)
+
         return redirect("wiki", title=title)
     
+@never_cache
 def randpage(request):
-    entries = util.list_entries()
-    selection = random.choice(entries)
-    raw_html = markdown.markdown(util.get_entry(selection), extensions=["extra", "fenced_code"]) 
-    clean_html = bleach.clean(raw_html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
-    return render(request, "encyclopedia/wiki.html",{
-        "title":selection,
-        "wikis": mark_safe(clean_html)
-    })
+    # Redirect so the page is served (and cached, and 304'd) under its wiki URL
+    selection = util.random_entry()
+    if selection is None:
+        return redirect("index")
+    return redirect("wiki", title=selection)
         
     
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Cache warm-up, so the first visitors after a deploy or a worker restart do
+not pay for every render.
+
+warm_up() loads the search index and the link graph and renders entries
+into the HTML cache. With WIKI_WARM_CACHE on, apps.ready() runs it on a
+background thread in every process. `manage.py warm_cache` brings the
+index files shared by every process up to date with load_indexes(), or
+requests every page from a running server so its workers render them.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import images, links, search, util
+
+_started = threading.Event()
+
+
+def load_indexes():
+    """
+    Loads the search index and the link graph, re-reading the entries that
+    changed since their files were written.
+    """
+    search.get_index()
+    links.get_graph()
+
+
+def warm_up(titles=None, limit=None):
+    """
+    Loads the persisted indexes and renders up to `limit` entries (by
+    default WIKI_HTML_CACHE_SIZE, as more would only evict each other).
+    Returns (entries rendered, seconds).
+    """
+    started = time.perf_counter()
+    load_indexes()
+    images.registry.refresh()
+    if titles is None:
+        titles = util.list_entries()
+    if limit is None:
+        limit = getattr(settings, "WIKI_HTML_CACHE_SIZE", 256)
+    rendered = 0
+    for title in titles[:limit]:
+        if util.get_entry_html(title) is not None:
+            rendered += 1
+    return rendered, time.perf_counter() - started
+
+
+def start():
+    """
+    Runs warm_up() on a daemon thread, once per process.
+    """
+    if _started.is_set():
+        return None
+    _started.set()
+    thread = threading.Thread(target=warm_up, name="wiki-warmup", daemon=True)
+    thread.start()
+    return thread
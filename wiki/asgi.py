@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wiki.settings')
+# Serve the async views, so slow storage or rendering doesn't hold a thread per request
+os.environ.setdefault('WIKI_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -41,10 +41,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # No-op unless WIKI_INSTRUMENTATION is on
+    'encyclopedia.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
 
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'encyclopedia.middleware.WhiteNoiseMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -121,4 +123,98 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
-STATIC_ROOT = BASE_DIR
\ No newline at end of file
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# With WIKI_STATIC_MANIFEST=1, collectstatic writes content-hashed copies
+# plus .gz/.br siblings, and WhiteNoise serves the hashed names with
+# "Cache-Control: immutable". It needs `manage.py collectstatic` to have run
+# (templates fail without the manifest), so the plain storage is the default.
+WIKI_STATIC_MANIFEST = os.environ.get("WIKI_STATIC_MANIFEST", "") == "1"
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage" if WIKI_STATIC_MANIFEST
+        else "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+# Unhashed files (e.g. images referenced by URL) are cached for a day
+WHITENOISE_MAX_AGE = 60 * 60 * 24
+
+# Encyclopedia
+
+# Where entries and their metadata live:
+#   "encyclopedia.storage.FilesystemBackend": entries/*.md + datas/wikis.json
+#   "encyclopedia.storage.DatabaseBackend": the default database (run
+#   `manage.py migrate` and `manage.py migrate_storage` first)
+WIKI_STORAGE_BACKEND = "encyclopedia.storage.FilesystemBackend"
+
+# Cards per index page (the index is paginated with an ?after=<title> cursor)
+WIKI_INDEX_PAGE_SIZE = 48
+# Cards on a search results page (best matches first)
+WIKI_SEARCH_RESULTS = 48
+
+# Maximum number of rendered entries kept in memory per process (LRU)
+WIKI_HTML_CACHE_SIZE = 256
+# Keep every saved version of the entries in datas/revisions/ (see
+# encyclopedia/revisions.py); a full snapshot is stored every N revisions
+# and compressed diffs in between, so reading one replays at most N-1 diffs.
+# Off by default, as it adds a file per edited entry that only ever grows
+# (about the size of each change). Enable with WIKI_REVISIONS=1
+WIKI_REVISIONS = os.environ.get("WIKI_REVISIONS", "") == "1"
+WIKI_REVISION_SNAPSHOT_EVERY = 16
+
+# Rendered card grids are shared by every worker process through the
+# "fragments" cache, keyed by the catalog version (see util.bump_catalog), so
+# each change is rendered once in total rather than once per worker. Any
+# cross-process backend works (e.g. PyMemcacheCache when workers span hosts).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache", "fragments"),
+        "TIMEOUT": 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
+# Entries with at least WIKI_SECTIONS_MIN h1/h2 sections are rendered and
+# cached per section; the wiki page ships a table of contents and the first
+# WIKI_SECTIONS_FIRST_SCREEN sections, and loads the others as they scroll in
+WIKI_SECTIONS_MIN = 8
+WIKI_SECTIONS_FIRST_SCREEN = 3
+# Rendered sections kept in memory per process (LRU)
+WIKI_SECTION_CACHE_SIZE = 4096
+
+# Pre-render entries on a background thread when each process starts
+# (see encyclopedia/warmup.py). Enable with WIKI_WARM_CACHE=1
+WIKI_WARM_CACHE = os.environ.get("WIKI_WARM_CACHE", "") == "1"
+
+# Stage timings, Server-Timing headers, /metrics/ histograms and cProfile
+# (see encyclopedia/instrumentation.py). Enable with WIKI_INSTRUMENTATION=1
+WIKI_INSTRUMENTATION = os.environ.get("WIKI_INSTRUMENTATION", "") == "1"
+# Required (as ?_profile=, ?token= or an X-Wiki-Profile header) when DEBUG is off
+WIKI_PROFILE_TOKEN = os.environ.get("WIKI_PROFILE_TOKEN", "")
+# Fraction of requests profiled in the background into WIKI_PROFILE_DIR
+WIKI_PROFILE_SAMPLE_RATE = float(os.environ.get("WIKI_PROFILE_SAMPLE_RATE", "0"))
+WIKI_PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+
+# Route to the async views (encyclopedia/async_views.py); wiki/asgi.py sets it
+WIKI_ASYNC_VIEWS = os.environ.get("WIKI_ASYNC_VIEWS", "") == "1"
+# Threads rendering Markdown for the async views (0 = min(4, CPUs))
+WIKI_RENDER_WORKERS = int(os.environ.get("WIKI_RENDER_WORKERS", "0"))
+
+# Cache-Control max-age (seconds) per view. 0 sends "no-cache": browsers and
+# CDNs keep the page but revalidate it with its ETag on every request (and
+# usually get a 304), so an edit shows up at once, even to shared caches
+# that cannot be purged. Wiki pages, the index and search change with edits.
+WIKI_CACHE_MAX_AGE = {
+    "wiki": 0,
+    "index": 0,
+    "search": 0,
+    # Diffs between fixed revisions and versioned section URLs never change
+    "revision": 24 * 3600,
+}